@@ -2,8 +2,23 @@ from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import mysql.connector
 import cv2
+import numpy as np
 import os
-from threading import Lock
+import sys
+import time
+import threading
+import itertools
+import math
+import random
+import queue
+import asyncio
+import zlib
+from threading import Lock, Condition
+from typing import NamedTuple
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
 
 app = Flask(__name__)
 CORS(app)
@@ -39,10 +54,13 @@ ROOMS_CFG = [
         ],
     },
 ]
+# ตัวเลือกเพิ่มเติมต่อกล้อง (ใส่ใน dict ของกล้อง):
+#   "motion": True | {...}   เปิดตรวจการเคลื่อนไหว (ทับค่าใน MOTION_DEFAULTS ได้), False = ปิด
 
 _cam_lock = Lock()
 
-def get_rtsp_by_room_index(room_name: str, index: int):
+def get_camera_by_room_index(room_name: str, index: int):
+    """คืน dict ของกล้อง (สำเนา) หรือ None"""
     with _cam_lock:
         room = next((r for r in ROOMS_CFG if r.get("name") == room_name), None)
         if not room:
@@ -50,55 +68,931 @@ def get_rtsp_by_room_index(room_name: str, index: int):
         cams = room.get("cameras", [])
         if index < 0 or index >= len(cams):
             return None
-        return cams[index].get("rtsp_url")
+        return dict(cams[index])
+
+def get_rtsp_by_room_index(room_name: str, index: int):
+    cam = get_camera_by_room_index(room_name, index)
+    return cam.get("rtsp_url") if cam else None
 
 # =========================================
-# B) RTSP STREAMING (MJPEG)
+# B) RTSP STREAMING (MJPEG) — CAMERA HUB
 # =========================================
-def generate_frames_rtsp(rtsp_url: str):
-    """อ่านเฟรมจาก RTSP แล้วส่งเป็น MJPEG multipart"""
-    cap = cv2.VideoCapture(rtsp_url)
-    if not cap.isOpened():
-        print("❌ ไม่สามารถเชื่อมต่อกล้อง RTSP ได้:", rtsp_url)
-        return
+# กล้อง 1 ตัว = RTSP session 1 เส้น + thread อ่าน/ถอดรหัส/เข้ารหัส 1 ตัว
+# ผู้ชมกี่คนก็อ่านเฟรมล่าสุดจาก buffer เดียวกัน (ต้นทุน O(กล้อง) ไม่ใช่ O(ผู้ชม))
+CAMERA_IDLE_STOP_SEC = 10.0   # ไม่มีผู้ชมเกินเท่านี้ → ปิด RTSP session
+FRAME_WAIT_TIMEOUT_SEC = 5.0  # ผู้ชมรอเฟรมใหม่ได้นานสุดเท่านี้ก่อนตรวจสถานะใหม่
+# True = มี thread ดึงเฟรมจาก RTSP ตลอดเวลา แล้วเข้ารหัสเฉพาะเฟรมใหม่สุด
+#        (ผู้ชม/encoder ช้าไม่ทำให้ buffer ของ FFmpeg ค้าง ภาพไม่ดีเลย์สะสม)
+# False = อ่าน→เข้ารหัสทีละเฟรมใน thread เดียว (แบบเดิม)
+CAPTURE_DROP_STALE = True
+
+# เชื่อมต่อ RTSP ใหม่อัตโนมัติเมื่อหลุด: รอแบบ exponential backoff + jitter
+RECONNECT_BASE_SEC = 1.0
+RECONNECT_MAX_SEC = 60.0
+RECONNECT_OFFLINE_AFTER = 5   # ล้มเหลวติดกันกี่ครั้งถึงนับว่า offline
+RTSP_TIMEOUT_MSEC = 5000      # timeout ของการเปิด/อ่าน RTSP (กันค้างตลอดกาล)
+
+# snapshot: การขอภาพนิ่ง 1 ครั้ง = ให้กล้องทำงาน/เข้ารหัส tier นั้นต่ออีกช่วงหนึ่ง (lease)
+SNAPSHOT_LEASE_SEC = 15.0
+SNAPSHOT_MAX_AGE_SEC = 2.0    # เฟรมเก่ากว่านี้ → รอเฟรมใหม่ก่อน (ถ้ากล้องยัง live)
+SNAPSHOT_WAIT_SEC = 5.0       # รอเฟรมแรกได้นานสุดเท่านี้ ไม่งั้นตอบ 503
+SNAPSHOT_FPS = 1              # tier ของ snapshot เข้ารหัสแค่วินาทีละเฟรม
+
+# motion gating: ห้องที่ไม่มีอะไรขยับ ส่งเฟรมแค่ keep-alive ประหยัด CPU/เน็ต
+MOTION_ENABLED = False        # True = เปิดทุกกล้อง (กล้องที่กำหนด "motion" เองจะใช้ค่าของตัวเอง)
+MOTION_DEFAULTS = {
+    "width": 160,             # ย่อภาพเป็นความกว้างนี้ (ขาวดำ) ก่อนเทียบเฟรม
+    "pixel_delta": 25,        # pixel ต่างกันเกินค่านี้ (0-255) = เปลี่ยน
+    "threshold": 0.01,        # สัดส่วน pixel ที่เปลี่ยน >= ค่านี้ = มีการเคลื่อนไหว
+    "hold_sec": 3.0,          # นิ่งต่อเนื่องเท่านี้ถึงจบเหตุการณ์
+    "keepalive_sec": 2.0,     # ตอนนิ่ง เข้ารหัส/ส่งเฟรมแค่ทุกกี่วินาที
+}
+
+# mosaic: รวมทุกกล้องในห้องเป็นภาพเดียว (ช่องละ TILE_W x TILE_H)
+MOSAIC_TILE_W = 640
+MOSAIC_TILE_H = 360
+MOSAIC_FPS = 10
+
+# สถานะกล้อง (แสดงใน /api/rooms)
+CAM_IDLE = "idle"              # ยังไม่มีใครเปิดดู ไม่ได้ต่อ RTSP
+CAM_CONNECTING = "connecting"  # กำลังเปิดครั้งแรก ยังไม่เคยได้เฟรม
+CAM_LIVE = "live"              # ได้เฟรมปกติ
+CAM_DEGRADED = "degraded"      # หลุด กำลังต่อใหม่ ผู้ชมเห็นเฟรมล่าสุดค้างไว้
+CAM_OFFLINE = "offline"        # ต่อไม่ได้ติดกันหลายครั้ง (ยังลองต่อใหม่เรื่อย ๆ)
+
+
+def reconnect_delay(attempt: int) -> float:
+    """เวลารอก่อนต่อใหม่ครั้งที่ attempt (1, 2, ...) — exponential backoff แบบ equal jitter"""
+    delay = min(RECONNECT_MAX_SEC, RECONNECT_BASE_SEC * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def open_rtsp(rtsp_url: str):
+    """เปิด VideoCapture พร้อม timeout (OpenCV รุ่นเก่าที่ไม่รองรับ params จะเปิดแบบปกติ)"""
     try:
+        return cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, RTSP_TIMEOUT_MSEC,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, RTSP_TIMEOUT_MSEC,
+        ])
+    except (AttributeError, TypeError, cv2.error):
+        return cv2.VideoCapture(rtsp_url)
+
+class AsyncCondition(Condition):
+    """
+    threading.Condition ที่ coroutine รอได้ด้วย (โหมด ASGI ใน asgi.py)
+    notify_all() ปลุกทั้ง thread และ coroutine → producer เดิมไม่ต้องรู้ว่าใครรออยู่
+    """
+
+    def __init__(self, lock=None):
+        super().__init__(lock)
+        self._async_waiters = []   # (loop, future) — แก้ไขขณะถือ lock เสมอ
+
+    def notify_all(self):
+        super().notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_future, fut)
+            except RuntimeError:
+                pass    # loop ปิดไปแล้ว
+
+    async def await_for(self, predicate, timeout):
+        """แบบเดียวกับ wait_for แต่เป็น coroutine — เรียกโดย 'ไม่' ถือ lock, คืนค่า predicate ล่าสุด"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
         while True:
+            with self:
+                result = predicate()
+                remaining = deadline - loop.time()
+                if result or remaining <= 0:
+                    return result
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+
+def _resolve_future(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+MJPEG_PART_HEAD = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+MJPEG_PART_TAIL = b"\r\n"
+
+
+class FrameSlot(NamedTuple):
+    """เฟรมที่ห่อเป็น multipart chunk แล้ว (immutable) — ผู้ชมทุกคน yield object เดียวกัน"""
+    seq: int          # เลขลำดับเฟรม เพิ่มขึ้นเรื่อย ๆ
+    chunk: bytes      # boundary + header + JPEG + CRLF
+    ts: float         # time.time() ตอนอ่านเฟรมจากกล้องได้
+
+    def jpeg(self):
+        """JPEG payload แบบไม่ copy (memoryview ชี้เข้าไปใน chunk)"""
+        return memoryview(self.chunk)[len(MJPEG_PART_HEAD):-len(MJPEG_PART_TAIL)]
+
+
+def encode_mjpeg_chunk(frame, params=()):
+    """เข้ารหัส JPEG แล้วห่อเป็น multipart chunk ด้วยการ copy ครั้งเดียว (None ถ้าเข้ารหัสไม่ได้)"""
+    ret, buf = cv2.imencode(".jpg", frame, list(params))
+    if not ret:
+        return None
+    return b"".join((MJPEG_PART_HEAD, buf, MJPEG_PART_TAIL))
+
+
+# ---------- ระดับคุณภาพสตรีม (tier) ----------
+# ค่าจาก query (?w=640&q=60&fps=5) จะถูกปัดเข้าขั้นที่กำหนดไว้
+# เพื่อให้ผู้ชมที่ขอใกล้เคียงกันใช้ tier เดียวกัน (encode ต่อ tier ไม่ใช่ต่อผู้ชม)
+STREAM_WIDTHS = (0, 1280, 960, 640, 480, 320)   # 0 = ความละเอียดเดิมของกล้อง
+STREAM_QUALITIES = (95, 80, 70, 60, 50, 40)      # 95 = ค่า default ของ OpenCV
+STREAM_FPS = (0, 15, 10, 5, 2, 1)                # 0 = ไม่จำกัด (ตามกล้อง)
+
+STREAM_PROFILES = {
+    "full": {"w": 0,    "q": 95, "fps": 0},
+    "hd":   {"w": 1280, "q": 80, "fps": 15},
+    "sd":   {"w": 640,  "q": 60, "fps": 10},
+    "low":  {"w": 320,  "q": 50, "fps": 5},
+}
+DEFAULT_STREAM_PROFILE = "full"
+
+
+class StreamTier(NamedTuple):
+    w: int      # ความกว้างสูงสุด (0 = เท่าต้นฉบับ)
+    q: int      # JPEG quality
+    fps: int    # เฟรมเรตสูงสุด (0 = ไม่จำกัด)
+
+
+def _snap_down(value, steps):
+    """ปัดลงเป็นขั้นที่ใกล้ที่สุดที่ไม่เกิน value (0 = ไม่จำกัด)"""
+    if value <= 0:
+        return 0
+    limited = sorted(x for x in steps if x > 0)
+    fitting = [x for x in limited if x <= value]
+    return fitting[-1] if fitting else limited[0]
+
+
+def _snap_nearest(value, steps):
+    return min(steps, key=lambda x: abs(x - value))
+
+
+def parse_stream_tier(args):
+    """
+    แปลง query string เป็น StreamTier
+      ?profile=sd            → ใช้ค่าจาก STREAM_PROFILES
+      ?w=640&q=60&fps=5      → ทับค่าของ profile ทีละตัว (ปัดเข้าขั้นเสมอ)
+    คืน None ถ้า profile ไม่รู้จักหรือค่าไม่ใช่ตัวเลข
+    """
+    profile = STREAM_PROFILES.get((args.get("profile") or DEFAULT_STREAM_PROFILE).lower())
+    if profile is None:
+        return None
+    try:
+        w = int(args.get("w", profile["w"]))
+        q = int(args.get("q", profile["q"]))
+        fps = int(args.get("fps", profile["fps"]))
+    except (TypeError, ValueError):
+        return None
+    return StreamTier(
+        _snap_down(w, STREAM_WIDTHS),
+        _snap_nearest(q, STREAM_QUALITIES),
+        _snap_down(fps, STREAM_FPS),
+    )
+
+
+DEFAULT_STREAM_TIER = parse_stream_tier({})
+
+
+class _TierState:
+    """สถานะของ tier หนึ่งในกล้องหนึ่ง: เฟรมล่าสุด + จำนวนผู้ชม"""
+    __slots__ = ("slot", "viewers", "next_due", "encodes", "lease_until")
+
+    def __init__(self):
+        self.slot = None
+        self.viewers = 0
+        self.next_due = 0.0
+        self.encodes = 0     # จำนวนเฟรมที่ tier นี้ปล่อยออกมา (ใช้นับเฟรมที่ผู้ชมข้ามไป)
+        self.lease_until = 0.0   # มีคนขอ snapshot → เข้ารหัสต่อถึงเวลานี้ (monotonic)
+
+    def active(self, now):
+        return self.viewers > 0 or now < self.lease_until
+
+
+class FrameSource(ABC):
+    """
+    แหล่งเฟรม 1 แหล่ง (กล้อง หรือภาพรวมของห้อง) ที่มี thread ผลิตเฟรมของตัวเอง
+    แล้วแจกเฟรม JPEG ล่าสุดของแต่ละ tier ให้ผู้ชมทุกคน — subclass เขียนแค่ _run()
+    """
+
+    def __init__(self, room_name: str, index):
+        self.room_name = room_name
+        self.index = index
+        self._cond = AsyncCondition()
+        self._thread = None
+        self._tiers = {}           # StreamTier -> _TierState
+        self._seq = 0              # จำนวนเฟรมที่ผลิตได้
+        self._frame = None         # เฟรมดิบล่าสุด (numpy) สำหรับผู้ใช้ภายใน เช่น mosaic
+        self._viewers = 0
+        self._last_release = time.monotonic()
+        self._lease_until = 0.0    # snapshot lease ล่าสุด (monotonic)
+        self._fps = 0.0
+        self._fps_frames = 0
+        self._fps_t0 = time.monotonic()
+        self._clients = {}         # client id -> metrics ของผู้ชมแต่ละคน
+        self._client_ids = itertools.count(1)
+        # health
+        self._state = CAM_IDLE
+        self._failures = 0         # จำนวนครั้งที่ต่อ/อ่านล้มเหลวติดกัน
+        self._last_frame_at = None
+        self._next_retry_at = None
+
+    # ---------- lifecycle ----------
+    def acquire(self, tier: StreamTier = DEFAULT_STREAM_TIER):
+        """
+        ผู้ชม/ผู้ใช้เฟรมเข้ามา 1 ราย (เปิด thread ถ้ายังไม่ทำงาน)
+        tier=None = ผู้ใช้ภายในที่อ่านเฟรมดิบผ่าน latest_frame() ไม่ต้องเข้ารหัส JPEG
+        """
+        with self._cond:
+            self._viewers += 1
+            if tier is not None:
+                self._tiers.setdefault(tier, _TierState()).viewers += 1
+            self._ensure_running()
+
+    def _ensure_running(self):
+        """เรียกขณะถือ self._cond"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name=f"cam-{self.room_name}-{self.index}", daemon=True
+            )
+            self._thread.start()
+
+    def release(self, tier: StreamTier = DEFAULT_STREAM_TIER):
+        with self._cond:
+            self._viewers = max(0, self._viewers - 1)
+            state = self._tiers.get(tier) if tier is not None else None
+            if state is not None:
+                state.viewers = max(0, state.viewers - 1)
+            self._last_release = time.monotonic()
+
+    def _idle(self):
+        """ไม่มีผู้ชมนานพอแล้ว → ปลด thread ออก (ทำใน lock เดียวกับ acquire)"""
+        with self._cond:
+            now = time.monotonic()
+            if (self._viewers == 0 and now - self._last_release > CAMERA_IDLE_STOP_SEC
+                    and now >= self._lease_until):
+                self._thread = None
+                return True
+            return False
+
+    @abstractmethod
+    def _run(self):
+        """ลูปผลิตเฟรมใน thread ของตัวเอง (เรียก _publish ทุกเฟรม)"""
+
+    def _set_state(self, state):
+        with self._cond:
+            self._state = state
+
+    def _stop(self):
+        with self._cond:
+            if self._thread is threading.current_thread():
+                self._thread = None
+            self._state = CAM_IDLE
+            self._failures = 0
+            self._next_retry_at = None
+            self._cond.notify_all()
+
+    def _min_interval(self):
+        """ระยะห่างขั้นต่ำระหว่างเฟรมที่เข้ารหัส ณ ตอนนี้ (0 = ตาม tier) — subclass ปรับได้"""
+        return 0.0
+
+    def _due_tiers(self, now):
+        """tier ที่มีผู้ชมและถึงรอบ encode แล้ว (ตาม fps ของ tier)"""
+        gate = self._min_interval()
+        with self._cond:
+            due = []
+            for tier, state in self._tiers.items():
+                if not state.active(now) or now < state.next_due:
+                    continue
+                state.next_due = now + max(1.0 / tier.fps if tier.fps else 0.0, gate)
+                due.append(tier)
+            return due
+
+    def _reset_due(self):
+        """ให้ทุก tier เข้ารหัสเฟรมถัดไปทันที"""
+        with self._cond:
+            for state in self._tiers.values():
+                state.next_due = 0.0
+
+    def _publish(self, frame, ts):
+        now = time.monotonic()
+        resized = {}   # ย่อครั้งเดียวต่อความกว้าง ใช้ร่วมกันหลาย quality
+        encoded = {}
+        for tier in self._due_tiers(now):
+            img = resized.get(tier.w)
+            if img is None:
+                img = frame
+                h, w = frame.shape[:2]
+                if tier.w and w > tier.w:
+                    img = cv2.resize(frame, (tier.w, max(1, h * tier.w // w)),
+                                     interpolation=cv2.INTER_AREA)
+                resized[tier.w] = img
+            chunk = encode_mjpeg_chunk(img, (cv2.IMWRITE_JPEG_QUALITY, tier.q))
+            if chunk is not None:
+                encoded[tier] = chunk
+        with self._cond:
+            self._seq += 1
+            self._frame = frame
+            self._state = CAM_LIVE
+            self._failures = 0
+            self._last_frame_at = ts
+            for tier, chunk in encoded.items():
+                state = self._tiers[tier]
+                state.slot = FrameSlot(self._seq, chunk, ts)
+                state.encodes += 1
+            self._fps_frames += 1
+            if now - self._fps_t0 >= 1.0:
+                self._fps = self._fps_frames / (now - self._fps_t0)
+                self._fps_frames = 0
+                self._fps_t0 = now
+            self._cond.notify_all()
+
+    # ---------- subscribers ----------
+    def frames(self, tier: StreamTier = DEFAULT_STREAM_TIER):
+        """
+        generator สำหรับ Response แบบ multipart (ผู้ชม 1 คน)
+        ส่งเฉพาะเฟรมล่าสุดของ tier เสมอ ผู้ชมที่รับช้าจะข้ามเฟรมกลางทาง (นับไว้ใน skipped)
+        """
+        state, metrics = self._open_client(tier)
+        last_seq = 0
+        last_count = None
+
+        def ready():
+            return (state.slot is not None and state.slot.seq != last_seq) or self._thread is None
+
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(ready, timeout=FRAME_WAIT_TIMEOUT_SEC)
+                    if self._thread is None:
+                        return
+                    slot, count = state.slot, state.encodes
+                if slot is None:
+                    continue
+                if slot.seq == last_seq:
+                    # กล้องหลุด/กำลังต่อใหม่: ส่งเฟรมดีล่าสุดซ้ำ กันไม่ให้ browser/proxy ตัดการเชื่อมต่อ
+                    yield slot.chunk
+                    continue
+                if last_count is not None:
+                    metrics["skipped"] += max(0, count - last_count - 1)
+                last_seq, last_count = slot.seq, count
+                yield slot.chunk
+                self._record_sent(metrics, slot)
+        finally:
+            self._close_client(metrics, tier)
+
+    async def aframes(self, tier: StreamTier = DEFAULT_STREAM_TIER):
+        """frames() แบบ async generator (asgi.py) — รอเฟรมด้วย coroutine ไม่ถือ thread ต่อผู้ชม"""
+        state, metrics = self._open_client(tier)
+        last_seq = 0
+        last_count = None
+
+        def ready():
+            return (state.slot is not None and state.slot.seq != last_seq) or self._thread is None
+
+        try:
+            while True:
+                await self._cond.await_for(ready, FRAME_WAIT_TIMEOUT_SEC)
+                with self._cond:
+                    if self._thread is None:
+                        return
+                    slot, count = state.slot, state.encodes
+                if slot is None:
+                    continue
+                if slot.seq == last_seq:
+                    yield slot.chunk
+                    continue
+                if last_count is not None:
+                    metrics["skipped"] += max(0, count - last_count - 1)
+                last_seq, last_count = slot.seq, count
+                yield slot.chunk
+                self._record_sent(metrics, slot)
+        finally:
+            self._close_client(metrics, tier)
+
+    def _open_client(self, tier):
+        self.acquire(tier)
+        client_id = next(self._client_ids)
+        metrics = {"id": client_id, "tier": tier._asdict(), "sent": 0,
+                   "skipped": 0, "latency_ms": None}
+        with self._cond:
+            self._clients[client_id] = metrics
+            return self._tiers[tier], metrics
+
+    def _close_client(self, metrics, tier):
+        with self._cond:
+            self._clients.pop(metrics["id"], None)
+        self.release(tier)
+
+    @staticmethod
+    def _record_sent(metrics, slot):
+        # ดีเลย์ตั้งแต่ได้เฟรมจากกล้องจนส่งถึง socket ของผู้ชม (ฝั่งเซิร์ฟเวอร์)
+        latency = (time.time() - slot.ts) * 1000.0
+        prev = metrics["latency_ms"]
+        metrics["latency_ms"] = latency if prev is None else prev * 0.9 + latency * 0.1
+        metrics["sent"] += 1
+
+    def snapshot(self, tier: StreamTier = DEFAULT_STREAM_TIER, timeout=SNAPSHOT_WAIT_SEC):
+        """
+        FrameSlot ล่าสุดของ tier สำหรับภาพนิ่ง (ต่อ lease ให้กล้องทำงานต่อ)
+        ถ้าเฟรมที่มีเก่าเกินไปและกล้องยัง live จะรอเฟรมใหม่ก่อน
+        กล้องหลุดอยู่ → คืนเฟรมดีล่าสุด, ยังไม่เคยได้เฟรม → None
+        """
+        now = time.monotonic()
+        with self._cond:
+            state = self._tiers.setdefault(tier, _TierState())
+            state.lease_until = max(state.lease_until, now + SNAPSHOT_LEASE_SEC)
+            self._lease_until = max(self._lease_until, state.lease_until)
+            self._ensure_running()
+
+            def fresh():
+                slot = state.slot
+                if slot is None:
+                    return False
+                max_age = max(SNAPSHOT_MAX_AGE_SEC, self._min_interval())
+                return self._state != CAM_LIVE or time.time() - slot.ts <= max_age
+
+            self._cond.wait_for(fresh, timeout=timeout)
+            return state.slot
+
+    def latest(self, tier: StreamTier = DEFAULT_STREAM_TIER):
+        """FrameSlot ล่าสุดของ tier (None ถ้ายังไม่มีเฟรม)"""
+        with self._cond:
+            state = self._tiers.get(tier)
+            return state.slot if state else None
+
+    def latest_frame(self):
+        """(เฟรมดิบล่าสุด, ts) — ห้ามแก้ไข array ที่ได้ไป (ใช้ร่วมกัน)"""
+        with self._cond:
+            return self._frame, self._last_frame_at
+
+    def health(self):
+        """สถานะกล้องสำหรับหน้าเว็บ (ไม่เปิด RTSP เพิ่ม)"""
+        with self._cond:
+            return {
+                "state": self._state,
+                "last_frame_at": self._last_frame_at,
+                "failures": self._failures,
+                "next_retry_at": self._next_retry_at,
+            }
+
+    def stats(self):
+        with self._cond:
+            running = self._thread is not None
+            return {
+                "room": self.room_name,
+                "index": self.index,
+                "running": running,
+                "state": self._state,
+                "viewers": self._viewers,
+                "fps": round(self._fps, 2) if running else 0.0,
+                "frames": self._seq,
+                "encodes": sum(st.encodes for st in self._tiers.values()),
+                "tiers": [
+                    {**tier._asdict(), "viewers": st.viewers, "encodes": st.encodes}
+                    for tier, st in self._tiers.items()
+                    if st.active(time.monotonic())
+                ],
+                "clients": [
+                    {**m, "latency_ms": None if m["latency_ms"] is None else round(m["latency_ms"], 1)}
+                    for m in self._clients.values()
+                ],
+            }
+
+
+def motion_cfg_for(cam: dict):
+    """ค่า motion ของกล้อง (None = ปิด)"""
+    opt = cam.get("motion", MOTION_ENABLED)
+    if not opt:
+        return None
+    return {**MOTION_DEFAULTS, **(opt if isinstance(opt, dict) else {})}
+
+
+class MotionDetector:
+    """frame differencing บนภาพขาวดำย่อขนาด (ถูกมาก ทำได้ทุกเฟรม)"""
+
+    def __init__(self, cfg: dict):
+        self.cfg = cfg
+        self._prev = None
+        self._last_motion = None      # monotonic ล่าสุดที่เห็นการเคลื่อนไหว
+        self.moving = False
+        self.score = 0.0
+
+    def update(self, frame, now):
+        """
+        ป้อนเฟรมใหม่ คืน "start" / "end" เมื่อสถานะเปลี่ยน, None ถ้าเหมือนเดิม
+        """
+        h, w = frame.shape[:2]
+        sw = min(w, int(self.cfg["width"]))
+        small = cv2.resize(frame, (sw, max(1, h * sw // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        prev, self._prev = self._prev, gray
+        if prev is None or prev.shape != gray.shape:
+            return None
+        diff = cv2.absdiff(gray, prev)
+        self.score = float(np.count_nonzero(diff > self.cfg["pixel_delta"])) / diff.size
+        if self.score >= self.cfg["threshold"]:
+            self._last_motion = now
+            if not self.moving:
+                self.moving = True
+                return "start"
+        elif self.moving and now - self._last_motion >= self.cfg["hold_sec"]:
+            self.moving = False
+            return "end"
+        return None
+
+
+class _RawSlot:
+    """
+    เฟรมดิบล่าสุดของ reader thread 1 รอบการเชื่อมต่อ (โหมด CAPTURE_DROP_STALE)
+    สร้างใหม่ทุกครั้งที่ต่อ RTSP → reader รุ่นเก่าเขียน/ปิดได้แค่ slot ของตัวเอง ไม่ไปทับรุ่นใหม่
+    """
+
+    def __init__(self):
+        self.cond = Condition()
+        self.alive = True
+        self.seq = 0
+        self.raw = None            # (seq, frame, ts)
+
+
+class CameraWorker(FrameSource):
+    """อ่านเฟรมจาก RTSP ของกล้อง 1 ตัว (ต่อใหม่เองเมื่อหลุด)"""
+
+    def __init__(self, room_name: str, index: int, rtsp_url: str, label=None, motion_cfg=None):
+        super().__init__(room_name, index)
+        self.rtsp_url = rtsp_url
+        self.label = label or f"Camera {index + 1}"
+        self._motion = MotionDetector(motion_cfg) if motion_cfg else None
+        self._motion_started = None   # (datetime เริ่ม, คะแนนสูงสุด) ของเหตุการณ์ที่กำลังเกิด
+        self._motion_events = 0
+        self._reconnects = 0
+        self._dropped = 0          # เฟรมดิบที่ทิ้งเพราะ encoder ตามไม่ทัน
+
+    def _run(self):
+        """supervisor: ต่อ RTSP → อ่านจนหลุด → รอ backoff → ต่อใหม่ จนกว่าจะไม่มีผู้ชม"""
+        try:
+            while not self._idle():
+                self._set_state(CAM_CONNECTING if self._last_frame_at is None else CAM_DEGRADED)
+                cap = open_rtsp(self.rtsp_url)
+                try:
+                    if cap.isOpened():
+                        if CAPTURE_DROP_STALE:
+                            self._run_latest(cap)
+                        else:
+                            self._run_sequential(cap)
+                    else:
+                        print("❌ ไม่สามารถเชื่อมต่อกล้อง RTSP ได้:", self.rtsp_url)
+                finally:
+                    cap.release()
+                if not self._wait_before_reconnect():
+                    break
+        finally:
+            self._stop()
+
+    def _wait_before_reconnect(self):
+        """นับความล้มเหลวแล้วรอ backoff (False = ไม่มีผู้ชมแล้ว เลิกต่อ)"""
+        with self._cond:
+            self._failures += 1
+            self._reconnects += 1
+            failures = self._failures
+            if failures >= RECONNECT_OFFLINE_AFTER:
+                self._state = CAM_OFFLINE
+            elif self._last_frame_at is None:
+                self._state = CAM_CONNECTING
+            else:
+                self._state = CAM_DEGRADED
+            delay = reconnect_delay(failures)
+            deadline = time.monotonic() + delay
+            self._next_retry_at = time.time() + delay
+        while time.monotonic() < deadline:
+            if self._idle():
+                return False
+            time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+        with self._cond:
+            self._next_retry_at = None
+        return True
+
+    def _run_sequential(self, cap):
+        while not self._idle():
             ok, frame = cap.read()
             if not ok:
-                break
-            ret, buf = cv2.imencode(".jpg", frame)
-            if not ret:
-                break
-            yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + buf.tobytes() + b"\r\n")
-    finally:
-        cap.release()
+                return
+            self._publish(frame, time.time())
+
+    def _run_latest(self, cap):
+        """encoder loop: เอาเฉพาะเฟรมดิบใหม่สุดจาก reader thread มาเข้ารหัส"""
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        slot = _RawSlot()
+        last_raw = 0
+        reader = threading.Thread(
+            target=self._read_loop, args=(cap, slot),
+            name=f"cam-read-{self.room_name}-{self.index}", daemon=True,
+        )
+        reader.start()
+        try:
+            while not self._idle():
+                with slot.cond:
+                    slot.cond.wait_for(
+                        lambda: slot.seq != last_raw or not slot.alive,
+                        timeout=FRAME_WAIT_TIMEOUT_SEC,
+                    )
+                    if not slot.alive:
+                        break
+                    if slot.seq == last_raw:
+                        continue
+                    raw_seq, frame, ts = slot.raw
+                if last_raw:
+                    self._dropped += raw_seq - last_raw - 1
+                last_raw = raw_seq
+                self._publish(frame, ts)
+        finally:
+            with slot.cond:
+                slot.alive = False
+                slot.raw = None
+            reader.join()
+
+    def _read_loop(self, cap, slot):
+        """reader thread: ดึงเฟรมจาก RTSP ให้เร็วที่สุด เก็บไว้เฉพาะเฟรมล่าสุดใน slot ของรอบนี้"""
+        try:
+            while True:
+                with slot.cond:
+                    if not slot.alive:
+                        return
+                ok, frame = cap.read()
+                if not ok:
+                    return
+                with slot.cond:
+                    if not slot.alive:
+                        return     # encoder เลิกรอแล้ว — ไม่เก็บเฟรมจาก cap ที่กำลังถูกปิด
+                    slot.seq += 1
+                    slot.raw = (slot.seq, frame, time.time())
+                    slot.cond.notify_all()
+        finally:
+            with slot.cond:
+                slot.alive = False
+                slot.cond.notify_all()
+
+    def _min_interval(self):
+        if self._motion is not None and not self._motion.moving:
+            return self._motion.cfg["keepalive_sec"]
+        return 0.0
+
+    def _publish(self, frame, ts):
+        if self._motion is not None:
+            self._track_motion(frame, ts)
+        super()._publish(frame, ts)
+
+    def _track_motion(self, frame, ts):
+        change = self._motion.update(frame, time.monotonic())
+        if change == "start":
+            self._motion_started = [datetime.fromtimestamp(ts), self._motion.score]
+            self._reset_due()   # เริ่มขยับ → ส่งเฟรมทันที ไม่ต้องรอรอบ keep-alive
+        elif self._motion_started is not None:
+            self._motion_started[1] = max(self._motion_started[1], self._motion.score)
+            if change == "end":
+                started, peak = self._motion_started
+                self._motion_started = None
+                self._motion_events += 1
+                record_motion_event(self.room_name, self.label, started,
+                                    datetime.fromtimestamp(ts), peak)
+
+    def stats(self):
+        result = super().stats()
+        with self._cond:
+            result.update(reconnects=self._reconnects, dropped=self._dropped)
+        if self._motion is not None:
+            result["motion"] = {
+                "moving": self._motion.moving,
+                "score": round(self._motion.score, 4),
+                "events": self._motion_events,
+            }
+        return result
+
+
+class MosaicWorker(FrameSource):
+    """
+    ภาพรวมของห้อง: ย่อเฟรมล่าสุดของทุกกล้องลงช่องของ canvas ที่จองไว้ครั้งเดียว
+    แล้วเข้ารหัสเป็นสตรีมเดียว (ผู้ชม 1 connection / 1 decode ต่อห้อง)
+    """
+
+    def __init__(self, room_name: str, cameras):
+        super().__init__(room_name, "mosaic")
+        self.cameras = list(cameras)       # [(label, CameraWorker)]
+        n = max(1, len(self.cameras))
+        self.cols = math.ceil(math.sqrt(n))
+        self.rows = math.ceil(n / self.cols)
+        self._canvas = np.zeros((self.rows * MOSAIC_TILE_H, self.cols * MOSAIC_TILE_W, 3), np.uint8)
+
+    def _tile(self, i):
+        y = (i // self.cols) * MOSAIC_TILE_H
+        x = (i % self.cols) * MOSAIC_TILE_W
+        return self._canvas[y:y + MOSAIC_TILE_H, x:x + MOSAIC_TILE_W]
+
+    def _run(self):
+        for _, cam in self.cameras:
+            cam.acquire(None)
+        interval = 1.0 / MOSAIC_FPS
+        tile_ts = [None] * len(self.cameras)
+        try:
+            self._set_state(CAM_CONNECTING)
+            while not self._idle():
+                t0 = time.monotonic()
+                newest = None
+                for i, (label, cam) in enumerate(self.cameras):
+                    frame, ts = cam.latest_frame()
+                    if frame is None or ts == tile_ts[i]:
+                        continue   # ไม่มีเฟรมใหม่ → คงภาพเดิมในช่องนี้ไว้
+                    tile = self._tile(i)
+                    cv2.resize(frame, (MOSAIC_TILE_W, MOSAIC_TILE_H), dst=tile,
+                               interpolation=cv2.INTER_AREA)
+                    cv2.putText(tile, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
+                                (255, 255, 255), 2, cv2.LINE_AA)
+                    tile_ts[i] = ts
+                    newest = ts if newest is None else max(newest, ts)
+                if newest is not None:
+                    self._publish(self._canvas, newest)
+                time.sleep(max(0.0, interval - (time.monotonic() - t0)))
+        finally:
+            for _, cam in self.cameras:
+                cam.release(None)
+            self._stop()
+
+class CameraHub:
+    """เก็บ CameraWorker ตาม (ห้อง, ลำดับกล้อง) ให้มีได้ตัวเดียวต่อกล้อง และ MosaicWorker ต่อห้อง"""
+
+    def __init__(self):
+        self._workers = {}
+        self._mosaics = {}
+        self._lock = Lock()
+
+    def get(self, room_name: str, index: int):
+        cam = get_camera_by_room_index(room_name, index)
+        if not cam or not cam.get("rtsp_url"):
+            return None
+        rtsp = cam["rtsp_url"]
+        key = (room_name, index)
+        with self._lock:
+            worker = self._workers.get(key)
+            if worker is None or worker.rtsp_url != rtsp:
+                worker = CameraWorker(room_name, index, rtsp, cam.get("label"), motion_cfg_for(cam))
+                self._workers[key] = worker
+            return worker
+
+    def health(self, room_name: str, index: int):
+        """สถานะของกล้อง โดยไม่สร้าง worker ใหม่ (กล้องที่ยังไม่มีใครเปิดดู = idle)"""
+        with self._lock:
+            worker = self._workers.get((room_name, index))
+        if worker is None:
+            return {"state": CAM_IDLE, "last_frame_at": None, "failures": 0, "next_retry_at": None}
+        return worker.health()
+
+    def mosaic(self, room_name: str):
+        with _cam_lock:
+            room = next((r for r in ROOMS_CFG if r.get("name") == room_name), None)
+            cams = [(c.get("label", f"Camera {i+1}"), i) for i, c in enumerate(room.get("cameras", []))] if room else []
+        if not cams:
+            return None
+        workers = [(label, self.get(room_name, i)) for label, i in cams]
+        with self._lock:
+            mosaic = self._mosaics.get(room_name)
+            if mosaic is None or [w for _, w in mosaic.cameras] != [w for _, w in workers]:
+                mosaic = MosaicWorker(room_name, workers)
+                self._mosaics[room_name] = mosaic
+            return mosaic
+
+    def stats(self):
+        with self._lock:
+            workers = list(self._workers.values()) + list(self._mosaics.values())
+        return [w.stats() for w in workers]
+
+
+camera_hub = CameraHub()
 
 # สตรีมกล้องตามห้อง/ลำดับกล้อง (index เริ่ม 0)
+# ?profile=full|hd|sd|low หรือ ?w=640&q=60&fps=5 (ปัดเข้า tier ที่ใช้ร่วมกัน)
 @app.route("/video_feed/<room_name>/<int:index>")
 def video_feed_room_index(room_name, index):
-    rtsp = get_rtsp_by_room_index(room_name, index)
-    if not rtsp:
+    worker = camera_hub.get(room_name, index)
+    if not worker:
         return Response("camera not found", status=404)
+    tier = parse_stream_tier(request.args)
+    if tier is None:
+        return Response("invalid stream profile", status=400)
+    return Response(
+        worker.frames(tier),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
+
+# ภาพรวมทุกกล้องในห้องเป็นสตรีมเดียว (tiled) — รองรับ query แบบเดียวกัน
+@app.route("/video_feed/<room_name>/mosaic")
+def video_feed_room_mosaic(room_name):
+    mosaic = camera_hub.mosaic(room_name)
+    if not mosaic:
+        return Response("room not found", status=404)
+    tier = parse_stream_tier(request.args)
+    if tier is None:
+        return Response("invalid stream profile", status=400)
     return Response(
-        generate_frames_rtsp(rtsp),
+        mosaic.frames(tier),
         mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
+# ภาพนิ่งล่าสุดของกล้อง (ใช้ทำ thumbnail/หน้าภาพรวม ไม่ต้องเปิดสตรีม)
+# รองรับ ?profile= / ?w=&q= แบบเดียวกับ /video_feed และ If-None-Match / If-Modified-Since
+@app.route("/api/snapshot/<room_name>/<int:index>", methods=["GET"])
+def api_snapshot(room_name, index):
+    worker = camera_hub.get(room_name, index)
+    if not worker:
+        return jsonify({"message": "camera not found"}), 404
+    tier = parse_stream_tier(request.args)
+    if tier is None:
+        return jsonify({"message": "invalid stream profile"}), 400
+    slot = worker.snapshot(tier._replace(fps=SNAPSHOT_FPS))
+    if slot is None:
+        resp = jsonify({"message": "camera unavailable", **worker.health()})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(int(RECONNECT_BASE_SEC) or 1)
+        return resp
+    resp = Response(bytes(slot.jpeg()), mimetype="image/jpeg")
+    resp.set_etag(f"{room_name}-{index}-{tier.w}-{tier.q}-{slot.seq}-{int(slot.ts * 1000)}")
+    resp.last_modified = datetime.fromtimestamp(slot.ts, tz=timezone.utc)
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+# สถานะกล้อง: จำนวนผู้ชม/เฟรมเรต ต่อกล้อง
+@app.route("/api/cameras/stats", methods=["GET"])
+def api_camera_stats():
+    return jsonify(camera_hub.stats())
+
 # ให้หน้าเว็บโหลดรายการห้อง–กล้อง (ไม่เปิดเผย RTSP)
 @app.route("/api/rooms", methods=["GET"])
 def api_rooms():
+    # weak ETag: เปลี่ยนเมื่อรายการห้อง/กล้องหรือสถานะกล้องเปลี่ยน (ไม่นับ last_frame_at ที่ขยับทุกเฟรม)
+    with _cam_lock:
+        shape = tuple(
+            (r["name"], tuple(c.get("label", f"Camera {i+1}") for i, c in enumerate(r.get("cameras", []))))
+            for r in ROOMS_CFG
+        )
+    states = tuple(
+        (h["state"], h["failures"])
+        for name, labels in shape for i in range(len(labels))
+        for h in (camera_hub.health(name, i),)
+    )
+    etag = f"rooms-{_BOOT_ID}-{zlib.crc32(repr((shape, states)).encode()):08x}"
+    cached = not_modified(etag, weak=True)
+    if cached:
+        return cached
     with _cam_lock:
         result = [
             {
                 "name": r["name"],
                 "cameras": [
-                    {"label": c.get("label", f"Camera {i+1}"), "index": i}
+                    {"label": c.get("label", f"Camera {i+1}"), "index": i,
+                     **camera_hub.health(r["name"], i)}
                     for i, c in enumerate(r.get("cameras", []))
                 ],
             }
             for r in ROOMS_CFG
         ]
-    return jsonify(result)
+    return with_etag(jsonify(result), etag, weak=True)
+
+# เหตุการณ์การเคลื่อนไหวล่าสุด (option: ?room=garden&limit=50)
+@app.route("/api/motion_events", methods=["GET"])
+def api_motion_events():
+    room = request.args.get("room")
+    try:
+        limit = max(1, min(500, int(request.args.get("limit", 100))))
+    except ValueError:
+        return jsonify({"message": "invalid limit"}), 400
+    with db_cursor() as (connection, cursor):
+        sql = """
+            SELECT id, room_name, camera_label, start_time, end_time, peak_score
+            FROM motion_events
+        """
+        params = []
+        if room:
+            sql += " WHERE room_name=%s"
+            params.append(room)
+        sql += " ORDER BY start_time DESC LIMIT %s"
+        params.append(limit)
+        cursor.execute(sql, tuple(params))
+        rows = cursor.fetchall()
+        for r in rows:
+            r["peak_score"] = float(r["peak_score"])
+        return jsonify(rows)
 
 
 # =========================================
@@ -133,30 +1027,481 @@ def apply_config_cursor(cursor, config_id):
     row = cursor.fetchone()
     return row_to_camel(row) if row else None
 
+# ---------- CONNECTION POOL ----------
+# ทุก handler ยืม connection จาก pool ผ่าน db_cursor() แทนการ connect/close ทุก request
+DB_POOL_SIZE = 10             # connection สูงสุด
+DB_POOL_TIMEOUT_SEC = 5.0     # รอ connection ว่างได้นานสุดเท่านี้ ไม่งั้นตอบ 503
+DB_POOL_PING_AFTER_SEC = 30.0 # connection ที่ว่างนานกว่านี้ ping ตรวจก่อนใช้ (pre-ping)
+
+
+class PoolTimeout(Exception):
+    """ยืม connection ไม่ได้ภายใน DB_POOL_TIMEOUT_SEC"""
+
+
+class DBPool:
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT_SEC):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()   # (connection, เวลาคืนล่าสุด) — LIFO ใช้ตัวที่เพิ่งคืนก่อน
+        self._lock = Lock()
+        self._created = 0
+        self._stats = {"checkouts": 0, "waits": 0, "wait_sec": 0.0, "timeouts": 0,
+                       "created": 0, "discarded": 0, "pings": 0}
+
+    def _new(self):
+        return mysql.connector.connect(**self.config)
+
+    def acquire(self):
+        t0 = time.monotonic()
+        with self._lock:
+            self._stats["checkouts"] += 1
+        try:
+            conn, idle_since = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    self._stats["created"] += 1
+                    grow = True
+                else:
+                    self._stats["waits"] += 1
+                    grow = False
+            if grow:
+                try:
+                    return self._new()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn, idle_since = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                    self._stats["wait_sec"] += time.monotonic() - t0
+                raise PoolTimeout(f"no database connection available within {self.timeout}s")
+            with self._lock:
+                self._stats["wait_sec"] += time.monotonic() - t0
+        if time.monotonic() - idle_since > DB_POOL_PING_AFTER_SEC:
+            with self._lock:
+                self._stats["pings"] += 1
+            try:
+                conn.ping(reconnect=True, attempts=1, delay=0)
+            except mysql.connector.Error:
+                self.discard(conn)
+                return self.acquire()
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            self.discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def discard(self, conn):
+        """ทิ้ง connection ที่เสีย (เปิดใหม่แทนได้ในการยืมครั้งถัดไป)"""
+        with self._lock:
+            self._created -= 1
+            self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            st = dict(self._stats)
+            created = self._created
+        idle = self._idle.qsize()
+        st["wait_sec"] = round(st["wait_sec"], 3)
+        st.update(size=self.size, open=created, idle=idle, in_use=created - idle,
+                  avg_wait_ms=round(st["wait_sec"] / st["waits"] * 1000.0, 1) if st["waits"] else 0.0)
+        return st
+
+
+db_pool = DBPool(db_config)
+
+@contextmanager
+def db_cursor(dictionary=True):
+    """
+    with db_cursor() as (connection, cursor): ...
+    ยืม connection จาก pool แล้วคืนเมื่อจบ (ไม่ commit ให้อัตโนมัติ — เรียก connection.commit() เอง)
+    """
+    connection = db_pool.acquire()
+    try:
+        cursor = connection.cursor(dictionary=dictionary)
+    except mysql.connector.Error:
+        db_pool.discard(connection)
+        raise
+    try:
+        yield connection, cursor
+    except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+        # connection น่าจะหลุด → ไม่คืนเข้า pool
+        try:
+            cursor.close()
+        except Exception:
+            pass
+        db_pool.discard(connection)
+        connection = None
+        raise
+    finally:
+        if connection is not None:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+            db_pool.release(connection)
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"message": "database busy, please retry"}), 503
+
+@app.route("/api/db/pool", methods=["GET"])
+def api_db_pool_stats():
+    return jsonify({**db_pool.stats(), "config_cache": config_cache.stats()})
+
+# ---------- เขียน DB เบื้องหลัง ----------
+# thread กล้อง/ตัวตรวจจับห้ามรอ DB → โยนงานเขียนเข้าคิว ให้ thread เดียวเขียนให้
+_db_write_queue = queue.Queue(maxsize=10000)
+_db_writer_thread = None
+_db_writer_lock = Lock()
+
+def enqueue_db_write(sql: str, params=()):
+    """เพิ่มคำสั่ง INSERT/UPDATE เข้าคิว (คิวเต็ม = ทิ้ง พร้อม log)"""
+    enqueue_db_transaction([(sql, params)])
+
+def enqueue_db_transaction(statements, on_commit=None):
+    """
+    เพิ่มหลายคำสั่งที่ต้อง commit พร้อมกัน [(sql, params), ...] (สำเร็จทั้งหมดหรือไม่มีเลย)
+    on_commit: เรียกใน thread writer หลัง commit สำเร็จ (เช่น ล้าง cache ที่เกี่ยวข้อง)
+    """
+    global _db_writer_thread
+    with _db_writer_lock:
+        if _db_writer_thread is None or not _db_writer_thread.is_alive():
+            _db_writer_thread = threading.Thread(target=_db_writer_loop, name="db-writer", daemon=True)
+            _db_writer_thread.start()
+    try:
+        _db_write_queue.put_nowait((list(statements), on_commit))
+    except queue.Full:
+        print("⚠️ คิวเขียน DB เต็ม ทิ้งรายการ:", statements[0][0].split()[0:3])
+
+def _db_writer_loop():
+    while True:
+        statements, on_commit = _db_write_queue.get()
+        try:
+            with db_cursor(dictionary=False) as (connection, cursor):
+                try:
+                    for sql, params in statements:
+                        cursor.execute(sql, params)
+                    connection.commit()
+                except mysql.connector.Error:
+                    connection.rollback()
+                    raise
+        except (mysql.connector.Error, PoolTimeout) as e:
+            print("❌ เขียน DB เบื้องหลังไม่สำเร็จ:", e)
+            continue
+        if on_commit is not None:
+            on_commit()
+
+def record_motion_event(room_name, camera_label, start_time, end_time, peak_score):
+    enqueue_db_write("""
+        INSERT INTO motion_events (room_name, camera_label, start_time, end_time, peak_score)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (room_name, camera_label, start_time, end_time, round(peak_score, 4)))
+
+# ---------- SCHEMA MIGRATIONS ----------
+# (version, ชื่อ, [SQL...]) — เพิ่มต่อท้ายเท่านั้น ห้ามแก้ของที่ deploy ไปแล้ว
+# รันด้วย: python App.py migrate (และรันอัตโนมัติตอนเปิดเซิร์ฟเวอร์ ยกเว้น DESTRUCTIVE_MIGRATIONS)
+# DDL ของ MySQL commit ทันที → migration ที่ล้มกลางทางจะค้างครึ่งเดียว ทุกขั้นจึงต้องรันซ้ำได้
+# (ADD COLUMN / CREATE INDEX ใช้ add_column_step / create_index_step ที่ตรวจ information_schema ก่อน)
+def add_column_step(table, column, definition):
+    def step(cursor):
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS"
+            " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column))
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+def create_index_step(table, name, columns, unique=False):
+    def step(cursor):
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.STATISTICS"
+            " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, name))
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+    return step
+
+# แถว alert ที่ซ้ำ (แมว, ประเภท, วัน) ยกเว้น id เล็กสุดของกลุ่ม
+# GROUP BY scan ตารางครั้งเดียว → derived table เล็ก (เฉพาะกลุ่มที่ซ้ำ) ที่ MySQL สร้าง index ให้เอง
+# แล้ว scan alerts_log อีกรอบ lookup กลุ่มผ่าน index นั้น — ไม่ใช่ self-join ทุกคู่แถว
+ALERT_DUPES_SQL = """
+    SELECT a.* FROM alerts_log a
+    JOIN (SELECT cat_name, alert_type, DATE(created_at) AS day, MIN(id) AS keep_id
+          FROM alerts_log
+          GROUP BY cat_name, alert_type, DATE(created_at)
+          HAVING COUNT(*) > 1) k
+      ON k.cat_name = a.cat_name AND k.alert_type = a.alert_type AND k.day = DATE(a.created_at)
+    WHERE a.id > k.keep_id
+"""
+
+def _dedupe_alerts_log(cursor):
+    # ลบแถวประวัติ alert ที่ซ้ำ — คัดลอกไว้ในตาราง alerts_log_dupes_<เวลา> ก่อน แล้วลบผ่าน primary key
+    cursor.execute(f"SELECT COUNT(*) FROM ({ALERT_DUPES_SQL}) d")
+    if not cursor.fetchone()[0]:
+        return
+    backup = f"alerts_log_dupes_{datetime.now():%Y%m%d%H%M%S}"
+    cursor.execute(f"CREATE TABLE {backup} AS {ALERT_DUPES_SQL}")
+    cursor.execute(f"DELETE a FROM alerts_log a JOIN {backup} b ON a.id = b.id")
+    print(f"⚠️ migration 2: ลบ alert ซ้ำออกจาก alerts_log {cursor.rowcount} แถว (สำรองไว้ที่ {backup})")
+
+SCHEMA_MIGRATIONS = [
+    (1, "motion_events", ["""
+        CREATE TABLE IF NOT EXISTS motion_events (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            room_name VARCHAR(50) NOT NULL,
+            camera_label VARCHAR(50) NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            peak_score DECIMAL(6,4) NOT NULL DEFAULT 0,
+            KEY idx_motion_room_start (room_name, start_time)
+        )
+    """]),
+    # กันซ้ำ alert ต่อ (แมว, ประเภท, วัน) ให้ชัดเจน → ingest ใช้ ON DUPLICATE KEY ได้โดยไม่ต้องจับ exception
+    # ⚠️ ขั้นแรก "ลบ" แถวประวัติที่ซ้ำออกจาก alerts_log (เหลือแถวแรกของแต่ละวัน) ก่อนสร้าง unique key
+    #    → อยู่ใน DESTRUCTIVE_MIGRATIONS: รันเฉพาะ python App.py migrate
+    (2, "alerts_log_unique_day", [
+        _dedupe_alerts_log,
+        add_column_step("alerts_log", "alert_day", "DATE AS (DATE(created_at)) STORED"),
+        create_index_step("alerts_log", "uq_alert_cat_type_day", "cat_name, alert_type, alert_day", unique=True),
+    ]),
+    # index สำหรับ query ที่กรองด้วยช่วงเวลา (ดู _hot_queries() / python App.py explain-check)
+    (3, "activity_time_indexes", [
+        create_index_step("cat_activities", "idx_act_cat_start_type", "cat_name, start_time, activity_type"),
+        create_index_step("cat_activities", "idx_act_start", "start_time"),
+        create_index_step("cat_movements", "idx_mv_cat_enter", "cat_name, enter_time"),
+    ]),
+    # สรุปรายวันต่อแมว (record_activity อัปเดตทันที, แถวจาก writer ภายนอก → change_watcher) — สถิติอ่านจากตารางนี้
+    (4, "cat_activity_daily", ["""
+        CREATE TABLE IF NOT EXISTS cat_activity_daily (
+            cat_name VARCHAR(100) NOT NULL,
+            day DATE NOT NULL,
+            sleep_minutes DECIMAL(12,2) NOT NULL DEFAULT 0,
+            eat_count INT NOT NULL DEFAULT 0,
+            excrete_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (cat_name, day)
+        )
+    """, lambda cursor: cursor.execute(rollup_backfill_sql())]),
+    # delta sync ของ alerts: แถวใหม่ตาม id (is_read, id) + แถวที่ถูกอ่าน/ซ่อนตาม updated_at
+    (5, "alerts_log_delta_sync", [
+        add_column_step("alerts_log", "updated_at", "DATETIME(6) NOT NULL"
+                        " DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)"),
+        create_index_step("alerts_log", "idx_alert_read_id", "is_read, id"),
+        create_index_step("alerts_log", "idx_alert_updated", "updated_at"),
+    ]),
+    # marker ของ change_watcher: แถวที่ยังอยู่ในห้อง (exit_time IS NULL) อ่านผ่าน index แทน scan ทั้งตาราง
+    (6, "cat_movements_exit_index", [
+        create_index_step("cat_movements", "idx_mv_exit", "exit_time"),
+    ]),
+]
+
+# migration ที่ลบ/แก้ข้อมูลเดิม — ไม่รันเองตอนเปิดเซิร์ฟเวอร์ ต้องสั่ง python App.py migrate
+# (ตอน start เจอแล้วหยุดตรงนั้น migration ถัดไปรอไว้ก่อน เพื่อคงลำดับ)
+DESTRUCTIVE_MIGRATIONS = {2}
+
+def run_migrations(allow_destructive=False):
+    with db_cursor(dictionary=False) as (connection, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {r[0] for r in cursor.fetchall()}
+        for version, name, statements in SCHEMA_MIGRATIONS:
+            if version in applied:
+                continue
+            if version in DESTRUCTIVE_MIGRATIONS and not allow_destructive:
+                print(f"⚠️ migration {version}: {name} ลบข้อมูลเดิม — ข้ามตอนเปิดเซิร์ฟเวอร์,"
+                      " รัน python App.py migrate เพื่อ apply (และ migration ที่เหลือ)")
+                return
+            for sql in statements:
+                if callable(sql):
+                    sql(cursor)    # ขั้นที่ใช้ SQL จาก section อื่น (เช่น backfill) — เรียกตอนรัน
+                else:
+                    cursor.execute(sql)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            connection.commit()
+            print(f"✅ migration {version}: {name}")
+
 # =========================================
 # D) SYSTEM CONFIG APIs 
 # =========================================
 from flask import jsonify
 
+# แถว system_config แทบไม่เปลี่ยน → cache ในหน่วยความจำ (read-through + TTL)
+# ล้าง cache ทุกครั้งที่ update/reset ผ่าน API และมี version ไว้ทำ ETag
+# แก้ DB ตรง ๆ: เห็นผลเมื่อครบ TTL — ถ้าค่าที่โหลดใหม่ต่างจากเดิม version จะเพิ่มด้วย (ETag เปลี่ยน)
+CONFIG_CACHE_TTL_SEC = 300.0
+_BOOT_ID = format(int(time.time()), "x")   # กัน ETag ชนกันข้ามการรีสตาร์ต
+
+
+class ConfigCache:
+    def __init__(self, ttl=CONFIG_CACHE_TTL_SEC):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = {}     # config_id -> (cfg camelCase, หมดอายุ monotonic)
+        self._versions = {}    # config_id -> เลข version (เพิ่มเมื่อถูกแก้)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, config_id, cursor=None):
+        """คืน dict config (camelCase) — cursor ใช้ตอน miss (ไม่ส่งมา = ยืมจาก pool เอง)"""
+        cfg, _ = self.get_tagged(config_id, cursor)
+        return cfg
+
+    def get_tagged(self, config_id, cursor=None):
+        """คืน (config, etag) ที่ตรงกันเสมอ — ETag คิดหลังรู้ค่าแล้ว จึงรวมผลของการโหลดใหม่ตอนครบ TTL"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(config_id)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return dict(entry[0]), self._etag(config_id)
+            self.misses += 1
+            version = self._versions.get(config_id, 0)
+        if cursor is not None:
+            cfg = apply_config_cursor(cursor, config_id)
+        else:
+            with db_cursor() as (_, cur):
+                cfg = apply_config_cursor(cur, config_id)
+        if cfg is None:
+            return None, None
+        with self._lock:
+            # ถ้ามีการแก้ระหว่างโหลด อย่าเก็บค่าเก่าลง cache
+            if self._versions.get(config_id, 0) == version:
+                if entry and entry[0] != cfg:
+                    # แถวถูกแก้นอก API (ครบ TTL แล้วค่าไม่เหมือนเดิม) → ETag ต้องเปลี่ยนด้วย
+                    self._versions[config_id] = version + 1
+                self._entries[config_id] = (cfg, now + self.ttl)
+            return dict(cfg), self._etag(config_id)
+
+    def invalidate(self, config_id):
+        with self._lock:
+            self._entries.pop(config_id, None)
+            self._versions[config_id] = self._versions.get(config_id, 0) + 1
+
+    def etag(self, config_id):
+        with self._lock:
+            return self._etag(config_id)
+
+    def _etag(self, config_id):
+        return f"cfg-{config_id}-{_BOOT_ID}-{self._versions.get(config_id, 0)}"
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "versions": {str(k): v for k, v in self._versions.items()}}
+
+
+config_cache = ConfigCache()
+
+# ---------- แถว cat_movements ที่ยังไม่ออกจากห้อง (ห้องปัจจุบันของแมวแต่ละตัว) ----------
+# hash ทุกแถวที่เปิดอยู่ (exit_time IS NULL ผ่าน idx_mv_exit) → เปลี่ยนทุกครั้งที่มีแมวเข้า/ออก ไม่ว่าใครเขียน
+# ไม่ใช้ MAX(exit_time): record_movement_exit ใส่เวลาที่เห็นครั้งสุดท้าย อาจน้อยกว่าแถวที่ปิดไปก่อนหน้า
+OPEN_MOVEMENTS_MARKER_SQL = """
+    SELECT COUNT(*) AS open_n,
+           COALESCE(SUM(CRC32(CONCAT_WS('|', id, cat_name, room_name))), 0) AS open_h
+    FROM cat_movements WHERE exit_time IS NULL
+"""
+OPEN_MOVEMENTS_SQL = "SELECT cat_name, room_name FROM cat_movements WHERE exit_time IS NULL"
+
+# ---------- ETag ของ resource ที่หน้าเว็บดึงบ่อย (cats / alerts) ----------
+# ETag คิดจาก marker ใน DB (PK/index อ่านไม่กี่แถว) → เปลี่ยนเมื่อข้อมูลเปลี่ยนจริง ไม่ว่าใครเป็นคนเขียน
+# cats: ตาราง cats เล็ก (hash ทั้งตาราง) + แถวที่เปิดอยู่ใน cat_movements (= current_room ของ get_cats)
+# alerts: แถวใหม่ (id) + แถวที่ถูกอ่าน/ซ่อน (updated_at)
+RESOURCE_ETAG_SQL = {
+    "cats": f"""
+        SELECT c.n, c.h, m.open_n, m.open_h
+        FROM (SELECT COUNT(*) AS n,
+                     COALESCE(SUM(CRC32(CONCAT_WS('|', name, image_url, status))), 0) AS h
+              FROM cats) c,
+             ({OPEN_MOVEMENTS_MARKER_SQL}) m
+    """,
+    "alerts": "SELECT COALESCE(MAX(id), 0) AS max_id, MAX(updated_at) AS max_updated FROM alerts_log",
+}
+
+def resource_etag(name, cursor=None):
+    """ETag ปัจจุบันของ resource — cursor ไม่ส่งมา = ยืมจาก pool เอง"""
+    if cursor is None:
+        with db_cursor() as (_, cur):
+            return resource_etag(name, cur)
+    cursor.execute(RESOURCE_ETAG_SQL[name])
+    marker = tuple(cursor.fetchone().values())
+    return f"{name}-{zlib.crc32(repr(marker).encode()):08x}"
+
+
+# version ในหน่วยความจำ ใช้ปลุก long-poll (ไม่ได้ใช้ทำ ETag)
+class ResourceVersions:
+    def __init__(self):
+        self._cond = AsyncCondition()
+        self._versions = {}
+
+    def bump(self, name):
+        with self._cond:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._cond.notify_all()    # ปลุก long-poll ที่รอ resource นี้อยู่
+
+    def version(self, name):
+        with self._cond:
+            return self._versions.get(name, 0)
+
+    def wait(self, name, version, timeout):
+        """รอจน version ของ name ไม่ใช่ค่าที่ให้มา (True) หรือหมดเวลา (False)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._versions.get(name, 0) != version, timeout)
+
+    async def await_change(self, name, version, timeout):
+        """wait() แบบ coroutine (asgi.py)"""
+        return await self._cond.await_for(lambda: self._versions.get(name, 0) != version, timeout)
+
+
+resource_versions = ResourceVersions()
+
+def not_modified(etag, weak=False):
+    """คืน 304 ถ้า If-None-Match ตรงกับ etag (ไม่ต้อง query/jsonify) ไม่งั้น None"""
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag, weak=weak)
+        return resp
+    return None
+
+def with_etag(resp, etag, weak=False):
+    resp.set_etag(etag, weak=weak)
+    resp.cache_control.no_cache = True   # browser เก็บไว้ได้ แต่ต้องถามก่อนใช้ทุกครั้ง → ได้ 304
+    return resp
+
 @app.route("/api/system_config", methods=["GET"])
 def get_system_config():
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
-    try:
-        cfg = apply_config_cursor(cursor, ACTIVE_CONFIG_ID)
-        if not cfg:
-            return jsonify({"message": "Error fetching system config"}), 500
-        return jsonify(cfg)
-    finally:
-        cursor.close()
-        connection.close()
+    # อ่านผ่าน cache ก่อนเทียบ ETag (hit ไม่แตะ DB) — ครบ TTL แล้วค่าเปลี่ยน ETag ก็เปลี่ยนตาม
+    cfg, etag = config_cache.get_tagged(ACTIVE_CONFIG_ID)
+    if not cfg:
+        return jsonify({"message": "Error fetching system config"}), 500
+    return not_modified(etag) or with_etag(jsonify(cfg), etag)
 
 @app.route("/api/system_config", methods=["POST"])
 def update_system_config():
     new_config = request.json or {}
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
-    try:
+    with db_cursor() as (connection, cursor):
         cursor.execute("SELECT * FROM system_config WHERE id=%s", (ACTIVE_CONFIG_ID,))
         current_cfg_snake = cursor.fetchone()
         if not current_cfg_snake:
@@ -194,16 +1539,18 @@ def update_system_config():
         )
         connection.commit()
         cursor2.close()
+        config_cache.invalidate(ACTIVE_CONFIG_ID)
+        alert_evaluator.notify("config")
+        _publish_config_changed(cursor)
         return jsonify({"message": "Config updated successfully"})
-    finally:
-        cursor.close()
-        connection.close()
+
+def _publish_config_changed(cursor):
+    cfg, etag = config_cache.get_tagged(ACTIVE_CONFIG_ID, cursor)
+    event_bus.publish("config", {"etag": etag, "config": cfg})
 
 @app.route("/api/system_config/reset", methods=["POST"])
 def reset_system_config():
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
-    try:
+    with db_cursor() as (connection, cursor):
         cursor.execute("SELECT * FROM system_config WHERE id=%s", (DEFAULT_CONFIG_ID,))
         default_config = cursor.fetchone()
         if not default_config:
@@ -236,10 +1583,10 @@ def reset_system_config():
         )
         connection.commit()
         cursor2.close()
+        config_cache.invalidate(ACTIVE_CONFIG_ID)
+        alert_evaluator.notify("config")
+        _publish_config_changed(cursor)
         return jsonify({"message": "System config has been reset to default values"})
-    finally:
-        cursor.close()
-        connection.close()
 
 # =========================================
 # E) ALERTS (Persistent)
@@ -247,146 +1594,270 @@ def reset_system_config():
 from datetime import datetime
 from flask import request
 
-def _compute_alerts_today(cursor):
-    """คำนวณ Alert ของ 'วันนี้' เทียบกับ system_config แล้วคืน list ของ alerts"""
-    cursor.execute("SELECT * FROM system_config WHERE id=%s", (ACTIVE_CONFIG_ID,))
-    config_row = cursor.fetchone()
-    if not config_row:
-        return []
+# ข้อมูลทั้งหมดที่กฎแจ้งเตือนต้องใช้ ดึงใน query เดียว (จำนวน query คงที่ ไม่ขึ้นกับจำนวนแมว)
+ALERT_SNAPSHOT_SQL = """
+    SELECT c.name AS cat_name,
+           lm.last_seen,
+           TIMESTAMPDIFF(HOUR, lm.last_seen, NOW()) AS hours_since_seen,
+           COALESCE(a.eats, 0) AS eats,
+           COALESCE(a.excretes, 0) AS excretes,
+           a.sleep_minutes
+    FROM cats c
+    LEFT JOIN (
+        SELECT cat_name, MAX(enter_time) AS last_seen
+        FROM cat_movements
+        GROUP BY cat_name
+    ) lm ON lm.cat_name = c.name
+    LEFT JOIN (
+        SELECT cat_name,
+               SUM(activity_type='eat') AS eats,
+               SUM(activity_type='excrete') AS excretes,
+               SUM(CASE WHEN activity_type='sleep' THEN duration_minutes END) AS sleep_minutes
+        FROM cat_activities
+        WHERE start_time >= CURDATE() AND start_time < CURDATE() + INTERVAL 1 DAY
+        GROUP BY cat_name
+    ) a ON a.cat_name = c.name
+    ORDER BY c.name
+"""
 
-    cfg = row_to_camel(config_row)
+def fetch_alert_snapshot(cursor):
+    """[{cat_name, last_seen, hours_since_seen, eats, excretes, sleep_minutes}] ของวันนี้"""
+    cursor.execute(ALERT_SNAPSHOT_SQL)
+    return cursor.fetchall()
+
+def evaluate_alert_rules(cfg, snapshot):
+    """ประเมินกฎทั้งหมดใน Python จาก snapshot เดียว (ไม่แตะ DB)"""
     alerts = []
 
     # 1) ไม่พบแมวนานเกินกำหนด (ชั่วโมง)
-    cursor.execute("""
-        SELECT c.name, MAX(m.enter_time) AS last_seen
-        FROM cats c
-        LEFT JOIN cat_movements m ON c.name = m.cat_name
-        GROUP BY c.name
-    """)
-    for row in cursor.fetchall():
-        if row["last_seen"]:
-            cursor.execute("SELECT TIMESTAMPDIFF(HOUR, %s, NOW()) AS hours", (row["last_seen"],))
-            diff = cursor.fetchone()["hours"]
-            if diff is not None and cfg.get("alertNoCat") is not None and diff >= cfg["alertNoCat"]:
-                alerts.append({
-                    "type": "no_cat",
-                    "cat": row["name"],
-                    "message": f"ไม่พบ {row['name']} เกิน {cfg['alertNoCat']} ชั่วโมง",
-                })
-
-    # 2) กินอาหาร (วันนี้)
-    cursor.execute("""
-        SELECT cat_name, COUNT(*) AS eats
-        FROM cat_activities
-        WHERE activity_type='eat' AND DATE(start_time)=CURDATE()
-        GROUP BY cat_name
-    """)
-    eat_map = {r["cat_name"]: r["eats"] for r in cursor.fetchall()}
-
-    cursor.execute("SELECT name FROM cats")
-    for cat in cursor.fetchall():
-        name = cat["name"]
-        if name in eat_map:
-            need = cfg.get("alertNoEating")
-            if need is not None and eat_map[name] < need:
-                alerts.append({
-                    "type": "no_eating",
-                    "cat": name,
-                    "message": f"{name} กินอาหารน้อยกว่า {need} ครั้ง/วัน",
-                })
+    limit = cfg.get("alertNoCat")
+    for row in snapshot:
+        diff = row["hours_since_seen"]
+        if row["last_seen"] and diff is not None and limit is not None and diff >= limit:
+            alerts.append({
+                "type": "no_cat",
+                "cat": row["cat_name"],
+                "message": f"ไม่พบ {row['cat_name']} เกิน {limit} ชั่วโมง",
+            })
+
+    # 2) กินอาหาร (วันนี้) — เฉพาะแมวที่มีบันทึกการกินวันนี้
+    need = cfg.get("alertNoEating")
+    for row in snapshot:
+        eats = int(row["eats"] or 0)
+        if eats and need is not None and eats < need:
+            name = row["cat_name"]
+            alerts.append({
+                "type": "no_eating",
+                "cat": name,
+                "message": f"{name} กินอาหารน้อยกว่า {need} ครั้ง/วัน",
+            })
 
     # 3) ขับถ่าย (วันนี้)
-    cursor.execute("""
-        SELECT cat_name, COUNT(*) AS excretes
-        FROM cat_activities
-        WHERE activity_type='excrete' AND DATE(start_time)=CURDATE()
-        GROUP BY cat_name
-    """)
-    excrete_map = {r["cat_name"]: r["excretes"] for r in cursor.fetchall()}
-
-    cursor.execute("SELECT name FROM cats")
-    for cat in cursor.fetchall():
-        name = cat["name"]
-        if name in excrete_map:
-            count = excrete_map[name]
-            if cfg.get("minExcretion") is not None and count < cfg["minExcretion"]:
-                alerts.append({
-                    "type": "low_excrete",
-                    "cat": name,
-                    "message": f"{name} ขับถ่ายน้อยกว่าที่กำหนด ({count}/{cfg['minExcretion']})",
-                })
-            if cfg.get("maxExcretion") is not None and count > cfg["maxExcretion"]:
-                alerts.append({
-                    "type": "high_excrete",
-                    "cat": name,
-                    "message": f"{name} ขับถ่ายมากกว่าที่กำหนด ({count}/{cfg['maxExcretion']})",
-                })
+    for row in snapshot:
+        count = int(row["excretes"] or 0)
+        if not count:
+            continue
+        name = row["cat_name"]
+        if cfg.get("minExcretion") is not None and count < cfg["minExcretion"]:
+            alerts.append({
+                "type": "low_excrete",
+                "cat": name,
+                "message": f"{name} ขับถ่ายน้อยกว่าที่กำหนด ({count}/{cfg['minExcretion']})",
+            })
+        if cfg.get("maxExcretion") is not None and count > cfg["maxExcretion"]:
+            alerts.append({
+                "type": "high_excrete",
+                "cat": name,
+                "message": f"{name} ขับถ่ายมากกว่าที่กำหนด ({count}/{cfg['maxExcretion']})",
+            })
 
     # 4) การนอน (วันนี้)
-    cursor.execute("""
-        SELECT cat_name, SUM(duration_minutes) AS sleep_minutes
-        FROM cat_activities
-        WHERE activity_type='sleep' AND DATE(start_time)=CURDATE()
-        GROUP BY cat_name
-    """)
-    sleep_map = {r["cat_name"]: (r["sleep_minutes"] if r["sleep_minutes"] is not None else None)
-                 for r in cursor.fetchall()}
-
-    cursor.execute("SELECT name FROM cats")
-    for cat in cursor.fetchall():
-        name = cat["name"]
-        if name in sleep_map and sleep_map[name] is not None:
-            mins = sleep_map[name] or 0
-            hours = mins / 60
-            if cfg.get("minSleep") is not None and hours < cfg["minSleep"]:
-                alerts.append({
-                    "type": "low_sleep",
-                    "cat": name,
-                    "message": f"{name} นอนน้อยเกินไป {hours:.1f} ชม. (min {cfg['minSleep']})",
-                })
-            if cfg.get("maxSleep") is not None and hours > cfg["maxSleep"]:
-                alerts.append({
-                    "type": "high_sleep",
-                    "cat": name,
-                    "message": f"{name} นอนมากเกินไป {hours:.1f} ชม. (max {cfg['maxSleep']})",
-                })
+    for row in snapshot:
+        if row["sleep_minutes"] is None:
+            continue
+        name = row["cat_name"]
+        hours = float(row["sleep_minutes"] or 0) / 60
+        if cfg.get("minSleep") is not None and hours < cfg["minSleep"]:
+            alerts.append({
+                "type": "low_sleep",
+                "cat": name,
+                "message": f"{name} นอนน้อยเกินไป {hours:.1f} ชม. (min {cfg['minSleep']})",
+            })
+        if cfg.get("maxSleep") is not None and hours > cfg["maxSleep"]:
+            alerts.append({
+                "type": "high_sleep",
+                "cat": name,
+                "message": f"{name} นอนมากเกินไป {hours:.1f} ชม. (max {cfg['maxSleep']})",
+            })
     return alerts
 
+def _compute_alerts_today(cursor):
+    """คำนวณ Alert ของ 'วันนี้' เทียบกับ system_config แล้วคืน list ของ alerts"""
+    cfg = config_cache.get(ACTIVE_CONFIG_ID, cursor)
+    if not cfg:
+        return []
+    return evaluate_alert_rules(cfg, fetch_alert_snapshot(cursor))
+
 def _ingest_alerts_today(cursor):
-    """คำนวณและบันทึกลง alerts_log เฉพาะ 'ของวันนี้' (กันซ้ำด้วย UNIQUE INDEX)"""
+    """
+    คำนวณและบันทึกลง alerts_log เฉพาะ 'ของวันนี้' ในคำสั่งเดียว
+    ซ้ำ (cat_name, alert_type, alert_day) → ข้าม ด้วย uq_alert_cat_type_day
+    คืน (inserted, skipped)
+    """
     new_alerts = _compute_alerts_today(cursor)
-    inserted = 0
-    for a in new_alerts:
+    if not new_alerts:
+        return 0, 0
+    # แถวซ้ำ: UPDATE id=id ไม่เปลี่ยนอะไร → affected rows = 0 จึงนับเฉพาะแถวที่เพิ่มจริง
+    cursor.executemany("""
+        INSERT INTO alerts_log (cat_name, alert_type, message, is_read, created_at)
+        VALUES (%s, %s, %s, 0, NOW())
+        ON DUPLICATE KEY UPDATE id = id
+    """, [(a["cat"], a["type"], a["message"]) for a in new_alerts])
+    inserted = max(cursor.rowcount, 0)
+    return inserted, len(new_alerts) - inserted
+
+ALERTS_SELECT_SQL = """
+    SELECT id, cat_name AS cat, alert_type AS type, message, is_read, created_at
+    FROM alerts_log
+    WHERE is_read <> 2
+"""
+
+# ---------- ประเมินกฎแจ้งเตือนเบื้องหลัง ----------
+# GET /api/alerts อ่านอย่างเดียว — การคำนวณ/บันทึก alert ทำใน thread นี้
+ALERT_EVAL_CFG = {
+    "interval_sec": 60.0,    # ประเมินซ้ำทุกกี่วินาที (กฎ no_cat ขึ้นกับเวลา จึงต้องรันตามรอบด้วย)
+    "debounce_sec": 3.0,     # มีกิจกรรมใหม่ → รอรวบหลายรายการ (และให้คิวเขียน DB ทัน) แล้วค่อยประเมิน
+}
+
+class AlertEvaluator:
+    def __init__(self, cfg=ALERT_EVAL_CFG):
+        self.cfg = cfg
+        self._thread = None
+        self._lock = Lock()
+        self._wake = threading.Event()
+        self._reason = None
+        self._stats = {"runs": 0, "errors": 0, "last_run_at": None, "last_duration_ms": None,
+                       "last_inserted": 0, "last_skipped": 0, "last_trigger": None, "last_error": None}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="alert-evaluator", daemon=True)
+            self._thread.start()
+
+    def notify(self, reason="activity"):
+        """ขอให้ประเมินใหม่เร็ว ๆ นี้ (เรียกได้จากทุก thread ไม่บล็อก)"""
+        with self._lock:
+            self._reason = self._reason or reason
+        self._wake.set()
+
+    def _run(self):
+        trigger = "startup"
+        while True:
+            self.evaluate(trigger)
+            woke = self._wake.wait(self.cfg["interval_sec"])
+            if woke:
+                time.sleep(self.cfg["debounce_sec"])
+                self._wake.clear()
+                with self._lock:
+                    trigger, self._reason = self._reason or "activity", None
+            else:
+                trigger = "timer"
+
+    def evaluate(self, trigger="manual"):
+        t0 = time.perf_counter()
+        inserted, skipped, error = 0, 0, None
         try:
-            cursor.execute("""
-                INSERT INTO alerts_log (cat_name, alert_type, message, is_read, created_at)
-                VALUES (%s, %s, %s, 0, NOW())
-            """, (a["cat"], a["type"], a["message"]))
-            inserted += 1
-        except mysql.connector.Error:
-            # ถ้าซ้ำ (unique) จะ error ก็ปล่อยผ่านเพื่อไม่สะสมซ้ำในวันเดียวกัน
-            pass
-    return inserted
+            with db_cursor() as (connection, cursor):
+                cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM alerts_log")
+                max_id = cursor.fetchone()["max_id"]
+                inserted, skipped = _ingest_alerts_today(cursor)
+                connection.commit()
+                if inserted:
+                    resource_versions.bump("alerts")
+                    cursor.execute(ALERTS_SELECT_SQL + " AND id > %s ORDER BY id", (max_id,))
+                    event_bus.publish("alerts", {"items": cursor.fetchall()})
+        except (mysql.connector.Error, PoolTimeout) as e:
+            error = str(e)
+            print("❌ ประเมิน alert ไม่สำเร็จ:", e)
+        with self._lock:
+            st = self._stats
+            st["runs"] += 1
+            st["last_run_at"] = datetime.now().isoformat(timespec="seconds")
+            st["last_duration_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+            st["last_trigger"] = trigger
+            if error:
+                st["errors"] += 1
+                st["last_error"] = error
+            else:
+                st["last_inserted"] = inserted
+                st["last_skipped"] = skipped
+        return inserted, skipped
+
+    def stats(self):
+        with self._lock:
+            st = dict(self._stats)
+        st.update(running=self._thread is not None and self._thread.is_alive(),
+                  interval_sec=self.cfg["interval_sec"])
+        return st
+
+
+alert_evaluator = AlertEvaluator()
+
+@app.route("/api/alerts/evaluator", methods=["GET"])
+def api_alert_evaluator_stats():
+    return jsonify(alert_evaluator.stats())
+
+ALERTS_ARGS_ERROR = "wait must be seconds, since_id int, since ISO datetime"
+
+def parse_alerts_args(args):
+    """query ของ /api/alerts → (cat, include_read, wait, since_id, since) — ValueError ถ้าค่าผิด (ใช้ร่วมกับ asgi.py)"""
+    since_id = args.get("since_id")
+    since = args.get("since")
+    wait = float(args.get("wait", 0))
+    if not math.isfinite(wait):
+        raise ValueError("wait must be finite")   # nan ผ่าน min/max ได้ แล้ว wait_for(nan) ค้างตลอดไป
+    return (
+        args.get("cat"),                              # optional - กรองตามแมว
+        args.get("include_read", "1") == "1",         # default รวมที่อ่านแล้ว
+        min(max(wait, 0.0), ALERTS_MAX_WAIT_SEC),
+        int(since_id) if since_id is not None else None,
+        datetime.fromisoformat(since) if since else None,
+    )
 
 @app.route("/api/alerts", methods=["GET"])
 def list_alerts():
-    """ดึงรายการแจ้งเตือน (จะ trigger ingest ของวันนี้ก่อนเสมอ)"""
-    cat = request.args.get("cat")  # optional - กรองตามแมว
-    include_read = request.args.get("include_read", "1") == "1"  # default รวมที่อ่านแล้ว
-
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
+    """
+    ดึงรายการแจ้งเตือน (อ่านอย่างเดียว — alert ถูกสร้างโดย AlertEvaluator)
+    ส่ง since_id มา = โหมด delta (ดู _alerts_delta)
+    wait=N (วินาที) = long-poll: ถ้ายังไม่มีอะไรใหม่ ค้างรอได้สูงสุด N วินาที (delta หรือ If-None-Match)
+    """
+    alert_evaluator.start()  # เผื่อรันผ่าน WSGI server อื่นที่ไม่ได้ผ่าน __main__
     try:
-        _ingest_alerts_today(cursor)
-        connection.commit()
+        cat, include_read, wait, since_id, since = parse_alerts_args(request.args)
+    except ValueError:
+        return jsonify({"message": ALERTS_ARGS_ERROR}), 400
+    if wait:
+        change_watcher.start()   # ปลุก long-poll เมื่อ process อื่นเขียน alerts_log ด้วย
+    # อ่าน version ก่อน query/ETag เสมอ: เปลี่ยนระหว่างนั้น → wait() คืนทันที ไม่หลับจนหมดเวลา
+    version = resource_versions.version("alerts")
+    if since_id is not None:
+        delta = _alerts_delta(cat, include_read, since_id, since)
+        if wait and since_id > 0 and not delta["items"] and not delta["tombstones"]:
+            # ไม่ถือ connection ระหว่างรอ — ตื่นเมื่อ evaluator/mark_read/delete เปลี่ยน alerts
+            if resource_versions.wait("alerts", version, wait):
+                delta = _alerts_delta(cat, include_read, since_id, since)
+        return jsonify(delta)
+    etag = resource_etag("alerts")
+    cached = not_modified(etag)
+    if cached and wait and resource_versions.wait("alerts", version, wait):
+        etag, cached = resource_etag("alerts"), None
+    if cached:
+        return cached
 
-        base_sql = """
-        SELECT id, cat_name AS cat, alert_type AS type, message, is_read, created_at
-        FROM alerts_log
-        WHERE 1=1
-        AND is_read <> 2          
-"""
+    with db_cursor() as (connection, cursor):
+        base_sql = ALERTS_SELECT_SQL
 
         params = []
         if cat:
@@ -398,10 +1869,63 @@ def list_alerts():
 
         cursor.execute(base_sql, tuple(params))
         rows = cursor.fetchall()
-        return jsonify(rows)
-    finally:
-        cursor.close()
-        connection.close()
+        return with_etag(jsonify(rows), etag)
+
+ALERTS_DELTA_LIMIT = 500
+ALERTS_MAX_WAIT_SEC = 60.0     # long-poll ค้างได้นานสุด (WSGI: ถือ worker thread 1 ตัวระหว่างรอ, asgi.py: coroutine)
+ALERT_SYNC_OVERLAP_SEC = 2.0   # ถอย since กลับเล็กน้อย กัน UPDATE ที่ commit ช้ากว่าเวลาที่บันทึก
+
+def alerts_delta_sql(include_read, by_cat, initial=False):
+    """
+    SQL แถวใหม่ของ delta sync — params: [since_id ถ้าไม่ใช่ initial], [cat ถ้า by_cat], limit
+    initial = รอบแรก (since_id=0): เอา limit แถวล่าสุด
+    """
+    visible = "is_read IN (0, 1)" if include_read else "is_read = 0"
+    cat_sql = " AND cat_name=%s" if by_cat else ""
+    sql = "SELECT id, cat_name AS cat, alert_type AS type, message, is_read, created_at FROM alerts_log"
+    if initial:
+        return sql + f" WHERE {visible}{cat_sql} ORDER BY id DESC LIMIT %s"
+    return sql + f" WHERE {visible} AND id > %s{cat_sql} ORDER BY id LIMIT %s"
+
+def alerts_tombstones_sql(by_cat):
+    """SQL tombstone ของ delta sync — params: since, since_id, [cat ถ้า by_cat]"""
+    return ("SELECT id, is_read FROM alerts_log"
+            " WHERE updated_at >= %s AND id <= %s AND is_read <> 0" + (" AND cat_name=%s" if by_cat else ""))
+
+def _alerts_delta(cat, include_read, since_id, since):
+    """
+    คืนเฉพาะสิ่งที่เปลี่ยนหลัง high-water mark ของ client:
+      items      = alert ใหม่ (id > since_id) เรียง id จากน้อยไปมาก สูงสุด ALERTS_DELTA_LIMIT
+      tombstones = [{id, is_read}] ของ alert เดิม (id <= since_id) ที่ถูกอ่าน (1) / ซ่อน (2) ตั้งแต่ since
+      since_id, since = ค่าที่ต้องส่งกลับมาครั้งถัดไป; more = ยังมีแถวใหม่ค้าง ให้เรียกต่อทันที
+    since_id=0 = เริ่มต้น: ได้ ALERTS_DELTA_LIMIT แถวล่าสุด
+    """
+    cat_params = (cat,) if cat else ()
+    with db_cursor() as (connection, cursor):
+        cursor.execute("SELECT NOW(6) AS now")
+        server_now = cursor.fetchone()["now"]
+        if since_id <= 0:
+            cursor.execute(alerts_delta_sql(include_read, bool(cat), initial=True),
+                           cat_params + (ALERTS_DELTA_LIMIT,))
+            items = cursor.fetchall()[::-1]
+            more = False
+        else:
+            cursor.execute(alerts_delta_sql(include_read, bool(cat)),
+                           (since_id,) + cat_params + (ALERTS_DELTA_LIMIT + 1,))
+            items = cursor.fetchall()
+            more = len(items) > ALERTS_DELTA_LIMIT
+            items = items[:ALERTS_DELTA_LIMIT]
+        tombstones = []
+        if since is not None and since_id > 0:
+            cursor.execute(alerts_tombstones_sql(bool(cat)), (since, since_id) + cat_params)
+            tombstones = cursor.fetchall()
+    return {
+        "items": items,
+        "tombstones": tombstones,
+        "since_id": items[-1]["id"] if items else max(since_id, 0),
+        "since": (server_now - timedelta(seconds=ALERT_SYNC_OVERLAP_SEC)).isoformat(),
+        "more": more,
+    }
 
 @app.route("/api/alerts/mark_read", methods=["PATCH"])
 def mark_alerts_read():
@@ -411,33 +1935,25 @@ def mark_alerts_read():
     if not isinstance(ids, list) or len(ids) == 0:
         return jsonify({"message": "ids required"}), 400
 
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor()
-    try:
+    with db_cursor(dictionary=False) as (connection, cursor):
         q = "UPDATE alerts_log SET is_read=1 WHERE id IN (" + ",".join(["%s"]*len(ids)) + ")"
         cursor.execute(q, tuple(ids))
         connection.commit()
+        resource_versions.bump("alerts")
         return jsonify({"updated": cursor.rowcount})
-    finally:
-        cursor.close()
-        connection.close()
 
 @app.route("/api/alerts/mark_all_read", methods=["PATCH"])
 def mark_all_read():
     """อ่านทั้งหมด (option: กรองตามแมว)"""
     cat = request.args.get("cat")
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor()
-    try:
+    with db_cursor(dictionary=False) as (connection, cursor):
         if cat:
             cursor.execute("UPDATE alerts_log SET is_read=1 WHERE cat_name=%s AND is_read=0", (cat,))
         else:
             cursor.execute("UPDATE alerts_log SET is_read=1 WHERE is_read=0")
         connection.commit()
+        resource_versions.bump("alerts")
         return jsonify({"updated": cursor.rowcount})
-    finally:
-        cursor.close()
-        connection.close()
 @app.route("/api/alerts/delete", methods=["DELETE"])
 def delete_alerts():
     """Archive (ซ่อน) รายการที่เลือก: ส่ง ids=[...]  -> is_read=2"""
@@ -446,16 +1962,122 @@ def delete_alerts():
     if not isinstance(ids, list) or len(ids) == 0:
         return jsonify({"message": "ids required"}), 400
 
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor()
-    try:
+    with db_cursor(dictionary=False) as (connection, cursor):
         q = "UPDATE alerts_log SET is_read=2 WHERE id IN (" + ",".join(["%s"]*len(ids)) + ")"
         cursor.execute(q, tuple(ids))
         connection.commit()
+        resource_versions.bump("alerts")
         return jsonify({"deleted": cursor.rowcount})
-    finally:
-        cursor.close()
-        connection.close()
+
+
+# =========================================
+# E2) EVENTS (Server-Sent Events)
+# =========================================
+# หน้าเว็บเปิด GET /api/events ค้างไว้ แทนการ poll ทุก 5 วินาที
+# ทุกการเปลี่ยนแปลง serialize ครั้งเดียวใน publish() แล้วทุก client ได้ bytes ชุดเดียวกัน
+# event: cat_room (แมวย้าย/ออกจากห้อง), alerts (alert ใหม่), config (system_config เปลี่ยน),
+#        reset (client ตามไม่ทัน backlog → ให้โหลดข้อมูลใหม่ทั้งหมด)
+SSE_BACKLOG = 256            # เก็บ event ล่าสุดไว้ให้ client ที่ reconnect พร้อม Last-Event-ID
+SSE_KEEPALIVE_SEC = 15.0
+SSE_RETRY_MS = 3000
+# id ของ event = "<BOOT_ID>-<seq>": seq นับใหม่ทุกครั้งที่ process เริ่ม
+# Last-Event-ID ที่ boot ไม่ตรง = มาจาก process ก่อนรีสตาร์ต → ส่ง reset (เลข seq เทียบกันไม่ได้)
+BOOT_ID = os.urandom(4).hex()
+
+
+class EventBus:
+    def __init__(self, backlog=SSE_BACKLOG):
+        self._cond = AsyncCondition()
+        self._events = deque(maxlen=backlog)   # (seq, bytes ที่พร้อมส่ง)
+        self._seq = 0
+        self.published = 0
+        self.subscribers = 0
+
+    def publish(self, event, data):
+        payload = app.json.dumps(data)
+        with self._cond:
+            self._seq += 1
+            msg = f"id: {BOOT_ID}-{self._seq}\nevent: {event}\ndata: {payload}\n\n".encode("utf-8")
+            self._events.append((self._seq, msg))
+            self.published += 1
+            self._cond.notify_all()
+
+    def subscribe(self, last_id=None):
+        """generator ของ bytes สำหรับ 1 client (คืน thread ทันทีที่ client ปิด)"""
+        last, stale = self._open(last_id)
+        try:
+            yield from self._greeting(last, stale)
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq > last, timeout=SSE_KEEPALIVE_SEC)
+                    pending, last = self._pending(last)
+                yield pending
+        finally:
+            self._close()
+
+    async def asubscribe(self, last_id=None):
+        """subscribe() แบบ async generator (asgi.py)"""
+        last, stale = self._open(last_id)
+        try:
+            for chunk in self._greeting(last, stale):
+                yield chunk
+            while True:
+                await self._cond.await_for(lambda: self._seq > last, SSE_KEEPALIVE_SEC)
+                with self._cond:
+                    pending, last = self._pending(last)
+                yield pending
+        finally:
+            self._close()
+
+    def _open(self, last_id):
+        """last_id = Last-Event-ID ดิบจาก client (None = เชื่อมต่อครั้งแรก)"""
+        boot, _, seq = (last_id or "").rpartition("-")
+        seq = int(seq) if boot == BOOT_ID and seq.isdecimal() else None
+        with self._cond:
+            self.subscribers += 1
+            # id จาก process ก่อนรีสตาร์ต / อ่านไม่ออก / เกินเลขปัจจุบัน → ให้ reset
+            stale = last_id is not None and (seq is None or seq > self._seq)
+            return (self._seq if last_id is None or stale else seq), stale
+
+    def _close(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    @staticmethod
+    def _greeting(last, stale):
+        yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+        if stale:
+            yield f"id: {BOOT_ID}-{last}\nevent: reset\ndata: {{}}\n\n".encode()
+
+    def _pending(self, last):
+        """bytes ที่ client ยังไม่ได้หลัง id=last (ต้องถือ lock) → (bytes, id ล่าสุด)"""
+        if self._seq <= last:
+            return b": keepalive\n\n", last
+        if not self._events or self._events[0][0] > last + 1:
+            # event ที่ client ยังไม่ได้ หลุดออกจาก backlog ไปแล้ว
+            return f"id: {BOOT_ID}-{self._seq}\nevent: reset\ndata: {{}}\n\n".encode(), self._seq
+        return b"".join(m for seq, m in self._events if seq > last), self._seq
+
+    def stats(self):
+        with self._cond:
+            return {"subscribers": self.subscribers, "published": self.published,
+                    "last_id": f"{BOOT_ID}-{self._seq}", "backlog": len(self._events)}
+
+
+event_bus = EventBus()
+
+@app.route("/api/events", methods=["GET"])
+def api_events():
+    change_watcher.start()   # cat_room จาก writer ภายนอกมาจาก thread นี้
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id") or None
+    resp = Response(event_bus.subscribe(last_id), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+@app.route("/api/events/stats", methods=["GET"])
+def api_events_stats():
+    return jsonify(event_bus.stats())
 
 
 # =========================================
@@ -463,9 +2085,12 @@ def delete_alerts():
 # =========================================
 @app.route("/api/cats", methods=["GET"])
 def get_cats():
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
-    try:
+    with db_cursor() as (connection, cursor):
+        # marker ก่อน query: ถ้ามีคนเขียนระหว่างนั้น ครั้งหน้า ETag จะต่างเอง (ไม่ค้างข้อมูลเก่า)
+        etag = resource_etag("cats", cursor)
+        cached = not_modified(etag)
+        if cached:
+            return cached
         query = """
             SELECT c.name, c.image_url, c.status, r.name AS current_room
             FROM cats c
@@ -478,59 +2103,859 @@ def get_cats():
         """
         cursor.execute(query)
         results = cursor.fetchall()
-        return jsonify(results)
-    finally:
-        cursor.close()
-        connection.close()
+        return with_etag(jsonify(results), etag)
+
+# ---------- ช่วงเวลาแบบ half-open [start, end) ----------
+# กรองด้วย start_time >= a AND start_time < b แทน DATE()/YEAR()/MONTH() เพื่อให้ใช้ index ได้
+def day_range(d):
+    start = datetime(d.year, d.month, d.day)
+    return start, start + timedelta(days=1)
+
+def month_range(year, month):
+    start = datetime(int(year), int(month), 1)
+    end = datetime(start.year + 1, 1, 1) if start.month == 12 else datetime(start.year, start.month + 1, 1)
+    return start, end
+
+def year_range(first_year, last_year=None):
+    last_year = first_year if last_year is None else last_year
+    return datetime(int(first_year), 1, 1), datetime(int(last_year) + 1, 1, 1)
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+ACTIVITIES_SELECT_SQL = """
+    SELECT id, cat_name, activity_type, start_time, end_time, duration_minutes
+    FROM cat_activities
+"""
+ACTIVITIES_MAX_PAGE = 5000
+ACTIVITIES_STREAM_CHUNK = 500     # fetchmany ทีละเท่านี้ตอน stream
+
+def activities_query(cat_name=None, start=None, end=None, after=None):
+    """
+    (sql, params) ของ /api/cat_activities — ใช้ตัวเดียวกันใน explain-check
+    start/end = datetime ขอบเขตครึ่งเปิด [start, end), after = (start_time, id) ของแถวสุดท้ายหน้าก่อน
+    """
+    where, params = [], []
+    if cat_name:
+        where.append("cat_name = %s")
+        params.append(cat_name)
+    if start is not None:
+        where.append("start_time >= %s")
+        params.append(start)
+    if end is not None:
+        where.append("end_time < %s")
+        params.append(end)
+    if after is not None:
+        # keyset: ต่อจากแถวสุดท้ายของหน้าก่อน (ใช้ index ของ start_time ไม่ต้อง OFFSET)
+        where.append("(start_time > %s OR (start_time = %s AND id > %s))")
+        params += [after[0], after[0], after[1]]
+    query = ACTIVITIES_SELECT_SQL
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return query + " ORDER BY start_time ASC, id ASC", params
+
+def _parse_activity_cursor(value):
+    """'<start_time ISO>,<id>' → (datetime, id)"""
+    ts, _, last_id = value.rpartition(",")
+    return datetime.fromisoformat(ts), int(last_id)
+
+def _activity_cursor(row):
+    return f"{row['start_time'].isoformat()},{row['id']}"
 
 @app.route("/api/cat_activities", methods=["GET"])
 def get_cat_activities():
+    """
+    Query params: cat_name, start_date, end_date (YYYY-MM-DD)
+      limit, after=<start_time,id> → หน้าละ limit แถว คืน {"items": [...], "next": cursor|null}
+      stream=ndjson | json         → ส่งทีละก้อนจาก cursor ฝั่ง server (หน่วยความจำคงที่)
+      ไม่ส่งทั้งสองแบบ             → list ทั้งหมดแบบเดิม
+    """
     cat_name = request.args.get("cat_name")
     start = request.args.get("start_date")
     end = request.args.get("end_date")
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
+    after = request.args.get("after")
+    limit = request.args.get("limit")
+    stream = request.args.get("stream")
+    if stream not in (None, "ndjson", "json"):
+        return jsonify({"message": "stream must be ndjson or json"}), 400
     try:
-        query = """
-            SELECT cat_name, activity_type, start_time, end_time, duration_minutes
-            FROM cat_activities
-            WHERE (%s IS NULL OR cat_name = %s)
-              AND (%s IS NULL OR DATE(start_time) >= %s)
-              AND (%s IS NULL OR DATE(end_time) <= %s)
-            ORDER BY start_time ASC
-        """
-        cursor.execute(query, (cat_name, cat_name, start, start, end, end))
-        results = cursor.fetchall()
-        return jsonify(results)
+        start = day_range(_parse_date(start))[0] if start else None
+        end = day_range(_parse_date(end))[1] if end else None
+    except ValueError:
+        return jsonify({"message": "start_date/end_date must be YYYY-MM-DD"}), 400
+    try:
+        after = _parse_activity_cursor(after) if after else None
+        if limit is not None:
+            limit = int(limit)
+            if not 1 <= limit <= ACTIVITIES_MAX_PAGE:
+                raise ValueError
+    except ValueError:
+        return jsonify({"message": f"after must be <start_time>,<id>; limit 1-{ACTIVITIES_MAX_PAGE}"}), 400
+
+    query, params = activities_query(cat_name, start, end, after)
+    if stream:
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        return Response(_stream_activities(query, tuple(params), stream),
+                        mimetype="application/x-ndjson" if stream == "ndjson" else "application/json")
+    if limit is None and not after:
+        with db_cursor() as (connection, cursor):
+            cursor.execute(query, tuple(params))
+            return jsonify(cursor.fetchall())
+
+    page = limit or ACTIVITIES_MAX_PAGE
+    with db_cursor() as (connection, cursor):
+        cursor.execute(query + " LIMIT %s", tuple(params) + (page + 1,))
+        rows = cursor.fetchall()
+    more = len(rows) > page
+    rows = rows[:page]
+    return jsonify({"items": rows, "next": _activity_cursor(rows[-1]) if more else None})
+
+def _stream_activities(query, params, fmt):
+    """
+    generator: อ่านจาก cursor แบบ unbuffered ทีละ ACTIVITIES_STREAM_CHUNK แถว แล้ว yield ออกไปเลย
+    ถือ connection จาก pool ไว้ตลอดการส่ง; ถ้า client ตัดกลางทาง (ยังอ่านผลไม่หมด) ทิ้ง connection นั้น
+    """
+    connection = db_pool.acquire()
+    cursor = None
+    finished = False
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(query, params)
+        first = True
+        if fmt == "json":
+            yield "["
+        while True:
+            rows = cursor.fetchmany(ACTIVITIES_STREAM_CHUNK)
+            if not rows:
+                break
+            if fmt == "ndjson":
+                yield "".join(app.json.dumps(r) + "\n" for r in rows)
+            else:
+                chunk = ",".join(app.json.dumps(r) for r in rows)
+                yield chunk if first else "," + chunk
+            first = False
+        if fmt == "json":
+            yield "]"
+        finished = True
     finally:
-        cursor.close()
-        connection.close()
+        if finished:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+            db_pool.release(connection)
+        else:
+            db_pool.discard(connection)
+
+# =========================================
+# F2) CAT DETECTION (CPU INFERENCE)
+# =========================================
+# ตรวจจับแมวจากเฟรมล่าสุดของทุกกล้อง (ใช้ CameraWorker ตัวเดียวกับสตรีม ไม่เปิด RTSP เพิ่ม)
+# แล้วเขียน cat_movements (เข้า/ออกห้อง) และ cat_activities (กิน/ขับถ่าย/นอน ตามโซนในภาพ)
+# ใช้ OpenCV DNN บน CPU กับโมเดล YOLO (ONNX, COCO) — ไม่มีไฟล์โมเดลก็แค่ไม่ทำงาน
+DETECT_CFG = {
+    "enabled": False,
+    "model": os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "yolov8n.onnx"),
+    "input_size": 640,        # ขนาดภาพเข้าโมเดล (สี่เหลี่ยมจัตุรัส)
+    "conf": 0.4,              # ความมั่นใจขั้นต่ำ
+    "nms": 0.45,
+    "class_id": 15,           # COCO: 15 = cat
+    "interval_sec": 1.0,      # ตรวจแต่ละกล้องทุกกี่วินาที (sub-sample จาก fps กล้อง) = deadline ต่อกล้อง
+    "max_batch": 8,           # จำนวนภาพสูงสุดต่อการ forward 1 ครั้ง (โมเดล export แบบ batch คงที่ → forward ทีละภาพ)
+    "tick_sec": 0.05,         # scheduler ตื่นมาตรวจ deadline ทุกกี่วินาที
+    "exit_after_sec": 60.0,   # ไม่เห็นแมวในห้องนานเท่านี้ = ออกจากห้อง
+    "room_switch_sec": 5.0,   # ต้องไม่เห็นในห้องเดิมอย่างน้อยเท่านี้ถึงนับว่าย้ายห้อง
+    "activity_min_sec": 20.0, # อยู่ในโซนอย่างน้อยเท่านี้ถึงนับเป็นกิจกรรม
+    "activity_gap_sec": 10.0, # ออกจากโซนไม่เกินเท่านี้ยังนับเป็นกิจกรรมเดิม
+    "threads": 0,             # cv2.setNumThreads (0 = ค่า default ของ OpenCV)
+}
+# โซนกิจกรรมต่อกล้อง: ใส่ใน dict ของกล้องใน ROOMS_CFG เป็นพิกัดสัดส่วน [x1, y1, x2, y2]
+#   "zones": {"eat": [0.1, 0.6, 0.3, 0.9], "excrete": [...], "sleep": [...]}
+#   "detect_interval_sec": 0.5   ทับ interval_sec เฉพาะกล้องนั้น
+ACTIVITY_TYPES = ("eat", "excrete", "sleep")
+
+
+def record_movement_enter(cat_name, room_name, when):
+    """แมวเข้าห้อง: ปิดห้องเดิม (ถ้ามี) แล้วเปิดแถวใหม่"""
+    enqueue_db_transaction([
+        ("""
+            UPDATE cat_movements SET exit_time=%s
+            WHERE cat_name=%s AND exit_time IS NULL
+        """, (when, cat_name)),
+        ("""
+            INSERT INTO cat_movements (cat_name, room_name, enter_time)
+            VALUES (%s, %s, %s)
+        """, (cat_name, room_name, when)),
+    ], on_commit=lambda: _on_movement_committed({"cat": cat_name, "room": room_name, "at": when}))
+
+
+def record_movement_exit(cat_name, room_name, when):
+    enqueue_db_transaction([("""
+        UPDATE cat_movements SET exit_time=%s
+        WHERE cat_name=%s AND room_name=%s AND exit_time IS NULL
+    """, (when, cat_name, room_name))],
+        on_commit=lambda: _on_movement_committed({"cat": cat_name, "room": None, "left": room_name, "at": when}))
+
+
+def _on_movement_committed(event):
+    resource_versions.bump("cats")
+    event_bus.publish("cat_room", event)
+
+
+def record_activity(cat_name, activity_type, start_time, end_time):
+    """บันทึกกิจกรรม 1 ครั้ง (ทุกที่ที่เขียน cat_activities ต้องผ่านฟังก์ชันนี้)"""
+    minutes = round((end_time - start_time).total_seconds() / 60.0, 2)
+    statements = [("""
+        INSERT INTO cat_activities (cat_name, activity_type, start_time, end_time, duration_minutes)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (cat_name, activity_type, start_time, end_time, minutes))]
+    if activity_type in ("sleep", "eat", "excrete"):
+        # rollup รายวันต้อง commit พร้อมแถวดิบ ไม่งั้นตัวเลขจะเพี้ยนถ้าอันใดอันหนึ่งล้ม
+        statements.append((ROLLUP_UPSERT_SQL, (
+            cat_name, start_time.date(),
+            minutes if activity_type == "sleep" else 0,
+            1 if activity_type == "eat" else 0,
+            1 if activity_type == "excrete" else 0,
+        )))
+    day = start_time.date()
+    enqueue_db_transaction(statements, on_commit=lambda: _on_activity_committed(cat_name, day))
+
+def _on_activity_committed(cat_name, day):
+    year_index.add(day.year)
+    stats_cache.invalidate(cat_name, day)
+    alert_evaluator.notify("activity")
+
+
+class CatIdentifier:
+    """
+    ระบุว่าแมวที่เห็นคือตัวไหน: เทียบ HSV histogram ของกรอบที่ตรวจเจอ
+    กับรูปของแมวแต่ละตัว (cats.image_url ที่เป็นไฟล์ในเครื่อง)
+    มีแมวตัวเดียวในระบบ → ตอบตัวนั้นเลย
+    """
+    MIN_SIMILARITY = 0.5
+    RELOAD_SEC = 600.0
+
+    def __init__(self):
+        self._refs = {}        # name -> histogram (None = ไม่มีรูปให้เทียบ)
+        self._loaded_at = 0.0
+
+    @staticmethod
+    def _hist(img):
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [30, 32], [0, 180, 0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def _reload(self):
+        with db_cursor() as (connection, cursor):
+            cursor.execute("SELECT name, image_url FROM cats")
+            rows = cursor.fetchall()
+        base = os.path.dirname(os.path.abspath(__file__))
+        refs = {}
+        for r in rows:
+            img = None
+            path = r.get("image_url") or ""
+            if path and "://" not in path:
+                img = cv2.imread(path if os.path.isabs(path) else os.path.join(base, path))
+            refs[r["name"]] = self._hist(img) if img is not None else None
+        self._refs = refs
+        self._loaded_at = time.monotonic()
+
+    def identify(self, crop):
+        if time.monotonic() - self._loaded_at > self.RELOAD_SEC:
+            try:
+                self._reload()
+            except (mysql.connector.Error, PoolTimeout) as e:
+                print("⚠️ โหลดรายชื่อแมวไม่สำเร็จ:", e)
+        if len(self._refs) == 1:
+            return next(iter(self._refs))
+        if crop is None or crop.size == 0:
+            return None
+        hist = self._hist(crop)
+        best, best_score = None, self.MIN_SIMILARITY
+        for name, ref in self._refs.items():
+            if ref is None:
+                continue
+            score = cv2.compareHist(hist, ref, cv2.HISTCMP_CORREL)
+            if score > best_score:
+                best, best_score = name, score
+        return best
+
+
+def parse_yolo_output(out, conf_th, class_id, frame_w, frame_h, input_size):
+    """
+    แปลงผลลัพธ์ YOLO ของภาพ 1 ภาพ → [(x, y, w, h, conf)] ในพิกัดของเฟรมจริง
+    รองรับทั้ง YOLOv8 (84 x N) และ YOLOv5 (N x 85, มี objectness)
+    """
+    out = np.squeeze(out)
+    if out.ndim != 2:
+        return []
+    if out.shape[0] < out.shape[1]:          # v8: (4 + classes, N)
+        preds = out.T
+        scores = preds[:, 4 + class_id]
+    else:                                    # v5: (N, 5 + classes)
+        preds = out
+        scores = preds[:, 4] * preds[:, 5 + class_id]
+    keep = scores >= conf_th
+    if not np.any(keep):
+        return []
+    preds, scores = preds[keep], scores[keep]
+    sx, sy = frame_w / input_size, frame_h / input_size
+    cx, cy, w, h = preds[:, 0] * sx, preds[:, 1] * sy, preds[:, 2] * sx, preds[:, 3] * sy
+    boxes = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+    idx = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), conf_th, DETECT_CFG["nms"])
+    return [(*boxes[i].tolist(), float(scores[i])) for i in np.array(idx).flatten()]
+
+
+class _CameraTrack:
+    """สถานะการติดตามแมวของกล้อง 1 ตัว"""
+
+    def __init__(self, room_name, label, zones):
+        self.room_name = room_name
+        self.label = label
+        self.zones = zones or {}
+        self.zone_since = {}      # (cat, activity) -> [เริ่ม datetime, เห็นล่าสุด datetime]
+
+
+class _ScheduledCamera:
+    """สถานะของกล้อง 1 ตัวใน InferenceScheduler"""
+    __slots__ = ("worker", "track", "interval", "deadline", "last_ts",
+                 "runs", "missed", "lateness_sec")
+
+    def __init__(self, worker, track, interval, now):
+        self.worker = worker
+        self.track = track
+        self.interval = interval
+        self.deadline = now           # ถึงกำหนดตรวจครั้งถัดไป (monotonic)
+        self.last_ts = None           # ts ของเฟรมที่ตรวจไปแล้ว
+        self.runs = 0
+        self.missed = 0               # ครั้งที่ถูกตรวจช้ากว่า deadline เกิน 1 รอบ
+        self.lateness_sec = 0.0       # รวมเวลาที่ช้ากว่า deadline
+
+
+class InferenceScheduler:
+    """
+    รวมเฟรมล่าสุดของหลายกล้องเป็น batch เดียวใน buffer ที่จองไว้ครั้งเดียว (N, 3, S, S)
+    - กล้องแต่ละตัวมี deadline = ตรวจครั้งก่อน + interval ของกล้อง
+    - เลือกกล้องที่ถึงกำหนดตาม deadline เก่าสุดก่อน (EDF) แล้วต่อด้วย round-robin
+      กล้องที่ได้ตรวจแล้ว deadline จะเลื่อนไป กล้องที่รออยู่จึงได้คิวก่อนเสมอ ไม่มีใครอดตาย
+    """
+
+    def __init__(self, input_size: int, max_batch: int):
+        self.size = input_size
+        self.max_batch = max_batch
+        self.batch = np.empty((max_batch, 3, input_size, input_size), np.float32)
+        self._resized = np.empty((input_size, input_size, 3), np.uint8)
+        self.cams = []
+        self._rr = 0                  # cursor ของ round-robin
+
+    def add(self, worker, track, interval):
+        self.cams.append(_ScheduledCamera(worker, track, interval, time.monotonic()))
+
+    def next_batch(self, now):
+        """เลือกกล้องที่ถึงกำหนดและมีเฟรมใหม่ แล้วเติมลง self.batch → [(cam, frame, ts)]"""
+        n = len(self.cams)
+        order = [self.cams[(self._rr + i) % n] for i in range(n)]
+        due = sorted((c for c in order if c.deadline <= now), key=lambda c: c.deadline)
+        picked = []
+        for cam in due:
+            if len(picked) >= self.max_batch:
+                break
+            frame, ts = cam.worker.latest_frame()
+            if frame is None or ts == cam.last_ts:
+                continue          # กล้องยังไม่มีเฟรมใหม่ → คง deadline ไว้ รอบหน้าได้ก่อน
+            late = now - cam.deadline
+            cam.lateness_sec += late
+            if late > cam.interval:
+                cam.missed += 1
+            cam.last_ts = ts
+            cam.deadline = now + cam.interval
+            cam.runs += 1
+            self._fill(len(picked), frame)
+            picked.append((cam, frame, ts))
+        if n:
+            self._rr = (self._rr + 1) % n
+        return picked
+
+    def _fill(self, i, frame):
+        """ย่อภาพลง buffer ตำแหน่ง i: BGR uint8 HWC → RGB float32 CHW [0, 1] โดยไม่จองหน่วยความจำใหม่"""
+        cv2.resize(frame, (self.size, self.size), dst=self._resized, interpolation=cv2.INTER_LINEAR)
+        np.multiply(self._resized[:, :, ::-1].transpose(2, 0, 1), 1 / 255.0, out=self.batch[i])
+
+    def next_wakeup(self, now, tick):
+        """เวลาที่ควรหลับก่อนรอบถัดไป"""
+        if not self.cams:
+            return tick
+        return min(tick, max(0.0, min(c.deadline for c in self.cams) - now))
+
+    def stats(self):
+        return [
+            {
+                "room": c.track.room_name,
+                "camera": c.track.label,
+                "interval_sec": c.interval,
+                "runs": c.runs,
+                "missed_deadlines": c.missed,
+                "avg_lateness_ms": round(c.lateness_sec / c.runs * 1000.0, 1) if c.runs else None,
+            }
+            for c in self.cams
+        ]
+
+
+class CatDetector:
+    """
+    pipeline: InferenceScheduler เลือกกล้องที่ถึงกำหนด → batch เดียว
+    → forward 1 ครั้ง → แยกผลกลับไปแต่ละกล้อง → อัปเดตห้อง/กิจกรรมของแมว
+    """
+
+    def __init__(self, cfg=DETECT_CFG):
+        self.cfg = cfg
+        self._thread = None
+        self._stop_evt = threading.Event()
+        self._net = None
+        self._net_batch = 1         # ภาพต่อการ forward 1 ครั้งที่โมเดลรับได้จริง (ตรวจตอน start)
+        self._identifier = CatIdentifier()
+        self._scheduler = None
+        self._last_seen = {}        # (cat, room) -> datetime ที่เห็นล่าสุด
+        self._cat_room = {}         # cat -> ห้องปัจจุบัน
+        self._lock = Lock()
+        self._stats = {"batches": 0, "frames": 0, "detections": 0, "infer_sec": 0.0,
+                       "last_batch_ms": None, "error": None, "errors": 0}
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if not os.path.exists(self.cfg["model"]):
+            self._stats["error"] = f"model not found: {self.cfg['model']}"
+            print("⚠️ ไม่พบไฟล์โมเดลตรวจจับแมว:", self.cfg["model"])
+            return
+        if self.cfg.get("threads"):
+            cv2.setNumThreads(int(self.cfg["threads"]))
+        self._net = cv2.dnn.readNet(self.cfg["model"])
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self._net_batch = self._probe_batch()
+        self._stop_evt.clear()
+        self._thread = threading.Thread(target=self._run, name="cat-detector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_evt.set()
+
+    def _probe_batch(self):
+        """
+        yolov8n.onnx ที่ export มาตรฐานมี batch คงที่ = 1 → forward หลายภาพแล้ว cv2.error
+        ลอง forward 2 ภาพครั้งเดียวตอน start: ไม่ผ่าน = ใช้ทีละภาพ (scheduler ยังรวมกล้องเป็นรอบเดียวเหมือนเดิม)
+        """
+        max_batch = int(self.cfg["max_batch"])
+        if max_batch <= 1:
+            return 1
+        size = self.cfg["input_size"]
+        try:
+            self._net.setInput(np.zeros((2, 3, size, size), np.float32))
+            out = self._net.forward()
+        except cv2.error:
+            out = None
+        if out is None or out.shape[0] != 2:
+            print("⚠️ โมเดลตรวจจับแมวรับ batch คงที่ — forward ทีละภาพ")
+            return 1
+        return max_batch
+
+    def _attach_cameras(self):
+        self._scheduler = InferenceScheduler(self.cfg["input_size"], self.cfg["max_batch"])
+        with _cam_lock:
+            cams = [(r["name"], i, c) for r in ROOMS_CFG for i, c in enumerate(r.get("cameras", []))]
+        for room_name, i, cam in cams:
+            worker = camera_hub.get(room_name, i)
+            if worker is None:
+                continue
+            worker.acquire(None)    # ให้กล้องทำงานตลอดแม้ไม่มีคนดู (ใช้เฟรมดิบ ไม่เข้ารหัส)
+            self._scheduler.add(
+                worker,
+                _CameraTrack(room_name, worker.label, cam.get("zones")),
+                float(cam.get("detect_interval_sec", self.cfg["interval_sec"])),
+            )
+
+    def _run(self):
+        self._attach_cameras()
+        try:
+            while not self._stop_evt.is_set():
+                try:
+                    self._tick()
+                except Exception as e:
+                    # เฟรม/โมเดลมีปัญหาครั้งเดียวไม่ควรทำให้ thread ตาย — เก็บไว้ให้เห็นใน /api/detection/stats
+                    error = f"{type(e).__name__}: {e}"
+                    with self._lock:
+                        repeated = self._stats["error"] == error
+                        self._stats["error"] = error
+                        self._stats["errors"] += 1
+                    if not repeated:
+                        print("⚠️ ตรวจจับแมวผิดพลาด:", error)
+                self._stop_evt.wait(self._scheduler.next_wakeup(time.monotonic(), self.cfg["tick_sec"]))
+        finally:
+            for cam in self._scheduler.cams:
+                cam.worker.release(None)
+
+    # ---------- inference ----------
+    def _tick(self):
+        picked = self._scheduler.next_batch(time.monotonic())
+        if picked:
+            results = self._infer([frame for _, frame, _ in picked])
+            for (cam, frame, ts), boxes in zip(picked, results):
+                self._update_track(cam.track, frame, boxes, datetime.fromtimestamp(ts))
+        self._expire_presence(datetime.now())
+
+    def _infer(self, frames):
+        """forward batch ที่ scheduler เติมไว้แล้ว (self._scheduler.batch[:len(frames)])"""
+        size = self.cfg["input_size"]
+        t0 = time.perf_counter()
+        n, step = len(frames), self._net_batch
+        outs = []
+        for i in range(0, n, step):
+            self._net.setInput(self._scheduler.batch[i:min(i + step, n)])
+            outs.append(self._net.forward())
+        out = outs[0] if len(outs) == 1 else np.concatenate(outs)
+        elapsed = time.perf_counter() - t0
+        results = [
+            parse_yolo_output(out[i], self.cfg["conf"], self.cfg["class_id"],
+                              f.shape[1], f.shape[0], size)
+            for i, f in enumerate(frames)
+        ]
+        with self._lock:
+            st = self._stats
+            st["batches"] += 1
+            st["frames"] += len(frames)
+            st["detections"] += sum(len(r) for r in results)
+            st["infer_sec"] += elapsed
+            st["last_batch_ms"] = round(elapsed * 1000.0, 1)
+        return results
+
+    # ---------- tracking ----------
+    def _update_track(self, track, frame, boxes, when):
+        fh, fw = frame.shape[:2]
+        seen = set()
+        for x, y, w, h, _ in boxes:
+            x1, y1 = max(0, int(x)), max(0, int(y))
+            crop = frame[y1:y1 + max(1, int(h)), x1:x1 + max(1, int(w))]
+            cat = self._identifier.identify(crop)
+            if cat is None or cat in seen:
+                continue
+            seen.add(cat)
+            self._mark_seen(cat, track.room_name, when)
+            cx, cy = (x + w / 2) / fw, (y + h / 2) / fh
+            for activity, zone in track.zones.items():
+                if activity not in ACTIVITY_TYPES:
+                    continue
+                key = (cat, activity)
+                if zone[0] <= cx <= zone[2] and zone[1] <= cy <= zone[3]:
+                    span = track.zone_since.setdefault(key, [when, when])
+                    span[1] = when
+        self._close_zones(track, when)
+
+    def _close_zones(self, track, now):
+        gap = timedelta(seconds=self.cfg["activity_gap_sec"])
+        min_len = timedelta(seconds=self.cfg["activity_min_sec"])
+        for key, (start, last) in list(track.zone_since.items()):
+            if now - last <= gap:
+                continue
+            del track.zone_since[key]
+            if last - start >= min_len:
+                record_activity(key[0], key[1], start, last)
+
+    def _mark_seen(self, cat, room_name, when):
+        self._last_seen[(cat, room_name)] = when
+        current = self._cat_room.get(cat)
+        if current == room_name:
+            return
+        if current is not None:
+            # ยังเพิ่งเห็นในห้องเดิม (เช่นกล้องสองห้องเห็นพร้อมกัน) → ยังไม่ย้ายห้อง
+            last_here = self._last_seen.get((cat, current))
+            if last_here and when - last_here < timedelta(seconds=self.cfg["room_switch_sec"]):
+                return
+        self._cat_room[cat] = room_name
+        record_movement_enter(cat, room_name, when)
+
+    def _expire_presence(self, now):
+        limit = timedelta(seconds=self.cfg["exit_after_sec"])
+        for cat, room_name in list(self._cat_room.items()):
+            last = self._last_seen.get((cat, room_name))
+            if last is not None and now - last > limit:
+                del self._cat_room[cat]
+                record_movement_exit(cat, room_name, last)
+
+    def stats(self):
+        with self._lock:
+            st = dict(self._stats)
+        running = self._thread is not None and self._thread.is_alive()
+        threads = cv2.getNumThreads() or 1
+        fps = st["frames"] / st["infer_sec"] if st["infer_sec"] else 0.0
+        st["infer_sec"] = round(st["infer_sec"], 3)
+        st.update(
+            running=running,
+            cameras=self._scheduler.stats() if self._scheduler else [],
+            threads=threads,
+            frames_per_sec=round(fps, 2),               # ถ้าใช้ CPU เต็มที่กับการ forward
+            frames_per_sec_per_core=round(fps / threads, 2),
+            # จำนวนกล้องที่รับไหวที่ interval ปัจจุบัน (ประมาณจาก throughput)
+            camera_capacity=int(fps * self.cfg["interval_sec"]),
+        )
+        return st
+
+
+cat_detector = CatDetector()
+
+@app.route("/api/detection/stats", methods=["GET"])
+def api_detection_stats():
+    return jsonify(cat_detector.stats())
+
 
 # =========================================
 # G) STATISTICS API
 # =========================================
 from decimal import Decimal
 
+# สถิติของแมว 1 ตัว — กรองด้วย cat_name + ช่วง start_time (ใช้ idx_act_cat_start_type)
+_STATS_SUMS = """
+      SUM(CASE WHEN activity_type='sleep'   THEN COALESCE(duration_minutes,0) ELSE 0 END) AS sleep_min,
+      SUM(CASE WHEN activity_type='eat'     THEN 1 ELSE 0 END) AS eat_count,
+      SUM(CASE WHEN activity_type='excrete' THEN 1 ELSE 0 END) AS excrete_count
+"""
+# ---------- rollup รายวัน (cat_activity_daily) ----------
+# 1 แถวต่อ (แมว, วัน) → กราฟรายวัน/เดือน/ปี อ่าน O(จำนวนวัน) แทน O(จำนวนกิจกรรม)
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO cat_activity_daily (cat_name, day, sleep_minutes, eat_count, excrete_count)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        sleep_minutes = sleep_minutes + VALUES(sleep_minutes),
+        eat_count = eat_count + VALUES(eat_count),
+        excrete_count = excrete_count + VALUES(excrete_count)
+"""
+
+def rollup_backfill_sql(since=False, until=False):
+    """INSERT ... SELECT สรุปรายวันจากข้อมูลดิบ (since=True → start_time >= %s, until=True → start_time < %s)"""
+    return """
+        INSERT INTO cat_activity_daily (cat_name, day, sleep_minutes, eat_count, excrete_count)
+        SELECT cat_name, DATE(start_time) AS day,""" + _STATS_SUMS + """
+        FROM cat_activities
+        WHERE activity_type IN ('sleep', 'eat', 'excrete')""" + (" AND start_time >= %s" if since else "") + (
+        " AND start_time < %s" if until else "") + """
+        GROUP BY cat_name, DATE(start_time)
+    """
+
+_ROLLUP_SUMS = """
+      SUM(sleep_minutes) AS sleep_min,
+      SUM(eat_count) AS eat_count,
+      SUM(excrete_count) AS excrete_count
+"""
+STATS_DAILY_SQL = """
+    SELECT day AS d, sleep_minutes AS sleep_min, eat_count, excrete_count
+    FROM cat_activity_daily
+    WHERE cat_name=%s AND day >= %s AND day < %s
+    ORDER BY day
+"""
+STATS_MONTHLY_SQL = """
+    SELECT MONTH(day) AS mo,""" + _ROLLUP_SUMS + """
+    FROM cat_activity_daily
+    WHERE cat_name=%s AND day >= %s AND day < %s
+    GROUP BY MONTH(day)
+    ORDER BY MONTH(day)
+"""
+STATS_YEARLY_SQL = """
+    SELECT YEAR(day) AS y,""" + _ROLLUP_SUMS + """
+    FROM cat_activity_daily
+    WHERE cat_name=%s AND day >= %s AND day < %s
+    GROUP BY YEAR(day)
+    ORDER BY YEAR(day)
+"""
+STATS_LAST_IN_RANGE_SQL = """
+    SELECT MAX(day) AS last_start
+    FROM cat_activity_daily
+    WHERE cat_name=%s AND day >= %s AND day < %s
+"""
+
+def _days(bounds):
+    """ช่วง datetime [a, b) → ช่วง DATE สำหรับคอลัมน์ day ของ rollup"""
+    return tuple(b.date() for b in bounds)
+
+def backfill_rollup(since=None):
+    """
+    คำนวณ cat_activity_daily ใหม่จาก cat_activities (ทั้งหมด หรือเฉพาะตั้งแต่วันที่ since)
+    ลบ + เติม ใน transaction เดียว → ระหว่างทำ หน้า Statistics ยังเห็นค่าชุดเดิม
+    """
+    with db_cursor(dictionary=False) as (connection, cursor):
+        try:
+            if since is None:
+                cursor.execute("DELETE FROM cat_activity_daily")
+                cursor.execute(rollup_backfill_sql())
+            else:
+                start = day_range(since)[0]
+                cursor.execute("DELETE FROM cat_activity_daily WHERE day >= %s", (start.date(),))
+                cursor.execute(rollup_backfill_sql(since=True), (start,))
+            rows = cursor.rowcount
+            connection.commit()
+        except mysql.connector.Error:
+            connection.rollback()
+            raise
+    year_index.reload()
+    stats_cache.clear()
+    return rows
+
 @app.route("/api/statistics/years", methods=["GET"])
 def api_statistics_years():
     """
     คืน 'ทุกปี' ที่มีข้อมูลใน cat_activities (เรียง ASC)
     ใช้เติมดรอปดาวน์ทั้ง 'ปีเริ่มต้น' และ 'ปีสิ้นสุด' ในหน้า Statistics
     """
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
-    try:
-        cursor.execute("""
-            SELECT DISTINCT YEAR(start_time) AS y
-            FROM cat_activities
-            WHERE start_time IS NOT NULL
-            ORDER BY y ASC
-        """)
-        years = [int(r["y"]) for r in cursor.fetchall() if r.get("y") is not None]
-        return jsonify({"years": years})
-    finally:
-        cursor.close()
-        connection.close()
+    return jsonify({"years": year_index.years()})
+
+
+# ---------- cache ผลลัพธ์ /api/statistics ----------
+# LRU จำกัดจำนวน + TTL ต่อรายการ: ช่วงที่ปิดแล้ว (จบก่อนวันนี้) เก็บนาน, ช่วงที่มีวันนี้เก็บสั้น
+# ล้างเมื่อ record_activity commit กิจกรรมของแมวตัวนั้นในช่วงวันที่รายการครอบคลุม
+STATS_CACHE_MAX_ENTRIES = 512
+STATS_CACHE_OPEN_TTL_SEC = 60.0
+STATS_CACHE_CLOSED_TTL_SEC = 3600.0   # ช่วงที่ปิดแล้วก็ยังเปลี่ยนได้ (ข้อมูลมาช้า) — change_watcher ล้างให้ตรงวันอยู่แล้ว
+YEAR_INDEX_REFRESH_SEC = 3600.0   # โหลดใหม่เป็นระยะ เผื่อมีการแก้ข้อมูลนอกแอป
+
+
+YEAR_INDEX_FIRST_SQL = "SELECT MIN(start_time) AS t FROM cat_activities"
+YEAR_INDEX_NEXT_SQL = "SELECT MIN(start_time) AS t FROM cat_activities WHERE start_time >= %s"
+
+
+class YearIndex:
+    """
+    ชุดปีที่มีข้อมูลใน cat_activities (เก็บในหน่วยความจำ)
+    โหลดด้วยการกระโดดทีละปีบน idx_act_start (1 index seek ต่อปี ไม่ scan ทั้งตาราง)
+    แล้วเพิ่มปีใหม่ตอน record_activity commit
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._years = None          # sorted list (None = ยังไม่โหลด)
+        self._written = set()       # ปีที่ process นี้เขียนเอง (กันหายถ้า commit ระหว่างกำลังโหลด)
+        self._loaded_at = 0.0
+
+    def _load(self):
+        years = []
+        with db_cursor() as (_, cursor):
+            floor = None
+            while True:
+                if floor is None:
+                    cursor.execute(YEAR_INDEX_FIRST_SQL)
+                else:
+                    cursor.execute(YEAR_INDEX_NEXT_SQL, (floor,))
+                row = cursor.fetchone()
+                if not row or row["t"] is None:
+                    break
+                years.append(row["t"].year)
+                floor = year_range(row["t"].year)[1]
+        return years
+
+    def _ensure(self):
+        with self._lock:
+            if self._years is not None and time.monotonic() - self._loaded_at < YEAR_INDEX_REFRESH_SEC:
+                return
+        self.reload()
+
+    def reload(self):
+        years = self._load()
+        with self._lock:
+            self._years = sorted(set(years) | self._written)
+            self._loaded_at = time.monotonic()
+
+    def add(self, year):
+        with self._lock:
+            self._written.add(year)
+            if self._years is not None and year not in self._years:
+                self._years = sorted(self._years + [year])
+
+    def years(self):
+        self._ensure()
+        with self._lock:
+            return list(self._years)
+
+    def bounds(self):
+        """(ปีแรก, ปีล่าสุด) หรือ (None, None) ถ้ายังไม่มีข้อมูล"""
+        self._ensure()
+        with self._lock:
+            return (self._years[0], self._years[-1]) if self._years else (None, None)
+
+
+year_index = YearIndex()
+
+
+class StatsCache:
+    def __init__(self, max_entries=STATS_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()   # key -> (payload, หมดอายุ monotonic, cat, scope)
+        self._gen = 0                   # เพิ่มทุกครั้งที่ล้าง → กันเก็บผลที่คำนวณก่อนข้อมูลเปลี่ยน
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self):
+        with self._lock:
+            return self._gen
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, payload, cat, scope, gen):
+        closed = scope is not None and scope[1] <= datetime.now().date()
+        ttl = STATS_CACHE_CLOSED_TTL_SEC if closed else STATS_CACHE_OPEN_TTL_SEC
+        with self._lock:
+            if self._gen != gen:
+                return
+            self._entries[key] = (payload, time.monotonic() + ttl, cat, scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, cat, day):
+        """กิจกรรมของ cat ในวัน day ถูกเขียน → ทิ้งรายการที่ครอบคลุมวันนั้น"""
+        with self._lock:
+            self._gen += 1
+            stale = [k for k, (_, _, c, scope) in self._entries.items()
+                     if c == cat and (scope is None or scope[0] <= day < scope[1])]
+            for k in stale:
+                del self._entries[k]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._gen += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 3) if total else None,
+                    "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+stats_cache = StatsCache()
+
+@app.route("/api/statistics/cache", methods=["GET"])
+def api_statistics_cache_stats():
+    return jsonify(stats_cache.stats())
 
 
 @app.route("/api/statistics", methods=["GET"])
@@ -552,144 +2977,472 @@ def api_statistics():
 
     if not cat:
         return jsonify({"message": "missing cat"}), 400
-
-    connection = mysql.connector.connect(**db_config)
-    cursor = connection.cursor(dictionary=True)
     try:
-        # หา min/max ปีใน DB ไว้ fallback ให้เลือกอัตโนมัติ
-        cursor.execute("""
-            SELECT MIN(YEAR(start_time)) AS miny,
-                   MAX(YEAR(start_time)) AS maxy
-            FROM cat_activities
-            WHERE start_time IS NOT NULL
-        """)
-        bounds = cursor.fetchone() or {}
-        miny = int(bounds["miny"]) if bounds.get("miny") else None
-        maxy = int(bounds["maxy"]) if bounds.get("maxy") else None
-
-        labels, sleep_min, eat_cnt, excrete_cnt = [], [], [], []
-        total_sleep = Decimal(0)
-        total_eat_cnt = 0
-        total_excrete = 0
-
-        if period == "daily":
-            # รายวัน: รวมต่อวันใน (ปี,เดือน) ที่เลือก (30 จุดฝั่งหน้าเว็บจะ align เอง)
-            if not year:
-                if maxy:
-                    year = str(maxy)
-                else:
-                    return jsonify({"labels": [], "series": {}, "summary": {}})
-            if not month:
-                cursor.execute("""
-                    SELECT LPAD(MONTH(MAX(start_time)),2,'0') AS m
-                    FROM cat_activities
-                    WHERE cat_name=%s AND YEAR(start_time)=%s
-                """, (cat, year))
-                mrow = cursor.fetchone()
-                month = (mrow["m"] if mrow and mrow["m"] else "01")
-
-            sql = """
-                SELECT DATE(start_time) AS d,
-                  SUM(CASE WHEN activity_type='sleep'   THEN COALESCE(duration_minutes,0) ELSE 0 END) AS sleep_min,
-                  SUM(CASE WHEN activity_type='eat'     THEN 1 ELSE 0 END) AS eat_count,
-                  SUM(CASE WHEN activity_type='excrete' THEN 1 ELSE 0 END) AS excrete_count
-                FROM cat_activities
-                WHERE cat_name=%s AND YEAR(start_time)=%s AND MONTH(start_time)=%s
-                GROUP BY DATE(start_time)
-                ORDER BY DATE(start_time)
-            """
-            cursor.execute(sql, (cat, year, month))
-            rows = cursor.fetchall() or []
-            for r in rows:
-                labels.append(r["d"].strftime("%Y-%m-%d"))
-                sl = float(r.get("sleep_min") or 0)
-                ea = int(r.get("eat_count") or 0)
-                ex = int(r.get("excrete_count") or 0)
-                sleep_min.append(sl); eat_cnt.append(ea); excrete_cnt.append(ex)
-                total_sleep += Decimal(sl); total_eat_cnt += ea; total_excrete += ex
-
-        elif period == "monthly":
-            # รายเดือน: รวมต่อเดือนในปีที่เลือก (12 จุด)
-            if not year:
-                if maxy:
-                    year = str(maxy)
-                else:
-                    return jsonify({"labels": [], "series": {}, "summary": {}})
-
-            sql = """
-                SELECT MONTH(start_time) AS mo,
-                  SUM(CASE WHEN activity_type='sleep'   THEN COALESCE(duration_minutes,0) ELSE 0 END) AS sleep_min,
-                  SUM(CASE WHEN activity_type='eat'     THEN 1 ELSE 0 END) AS eat_count,
-                  SUM(CASE WHEN activity_type='excrete' THEN 1 ELSE 0 END) AS excrete_count
-                FROM cat_activities
-                WHERE cat_name=%s AND YEAR(start_time)=%s
-                GROUP BY MONTH(start_time)
-                ORDER BY MONTH(start_time)
-            """
-            cursor.execute(sql, (cat, year))
-            rows = cursor.fetchall() or []
-            for r in rows:
-                labels.append(f"{int(year):04d}-{int(r['mo']):02d}")
-                sl = float(r.get("sleep_min") or 0)
-                ea = int(r.get("eat_count") or 0)
-                ex = int(r.get("excrete_count") or 0)
-                sleep_min.append(sl); eat_cnt.append(ea); excrete_cnt.append(ex)
-                total_sleep += Decimal(sl); total_eat_cnt += ea; total_excrete += ex
+        if any(v and not 1 <= int(v) <= 9998 for v in (year, start_year, end_year)):
+            raise ValueError
+        if month and not 1 <= int(month) <= 12:
+            raise ValueError
+    except ValueError:
+        return jsonify({"message": "invalid year/month"}), 400
+
+    change_watcher.start()   # เผื่อรันผ่าน WSGI server อื่นที่ไม่ได้ผ่าน __main__
+    miny, maxy = year_index.bounds()
+    key = (cat, period, year, month, start_year, end_year, miny, maxy)
+    payload = stats_cache.get(key)
+    if payload is None:
+        gen = stats_cache.generation()
+        with db_cursor() as (connection, cursor):
+            payload, scope = _compute_statistics(cursor, cat, period, year, month,
+                                                 start_year, end_year, miny, maxy)
+        stats_cache.put(key, payload, cat, scope, gen)
+    return jsonify(payload)
+
 
+def _compute_statistics(cursor, cat, period, year, month, start_year, end_year, miny, maxy):
+    """คืน (payload, scope) — scope = ช่วงวัน [lo, hi) ที่ผลลัพธ์ขึ้นกับมัน (ใช้ล้าง cache)"""
+    labels, sleep_min, eat_cnt, excrete_cnt = [], [], [], []
+    total_sleep = Decimal(0)
+    total_eat_cnt = 0
+    total_excrete = 0
+
+    if period == "daily":
+        # รายวัน: รวมต่อวันใน (ปี,เดือน) ที่เลือก (30 จุดฝั่งหน้าเว็บจะ align เอง)
+        if not year:
+            if maxy:
+                year = str(maxy)
+            else:
+                return {"labels": [], "series": {}, "summary": {}}, None
+        if not month:
+            cursor.execute(STATS_LAST_IN_RANGE_SQL, (cat, *_days(year_range(year))))
+            mrow = cursor.fetchone()
+            month = (f"{mrow['last_start'].month:02d}" if mrow and mrow["last_start"] else "01")
+            scope = _days(year_range(year))   # เดือนที่เลือกอัตโนมัติขึ้นกับข้อมูลทั้งปี
         else:
-            # รายปี: start_year → end_year (inclusive)
-            if not end_year and maxy: end_year = str(maxy)
-            if not start_year and miny: start_year = str(miny)
-            if not start_year or not end_year:
-                return jsonify({"labels": [], "series": {}, "summary": {}})
-
-            s_y = int(start_year); e_y = int(end_year)
-            if miny is not None: s_y = max(s_y, miny)
-            if maxy is not None: e_y = min(e_y, maxy)
-            if s_y > e_y: s_y, e_y = e_y, s_y
-
-            sql = """
-                SELECT YEAR(start_time) AS y,
-                  SUM(CASE WHEN activity_type='sleep'   THEN COALESCE(duration_minutes,0) ELSE 0 END) AS sleep_min,
-                  SUM(CASE WHEN activity_type='eat'     THEN 1 ELSE 0 END) AS eat_count,
-                  SUM(CASE WHEN activity_type='excrete' THEN 1 ELSE 0 END) AS excrete_count
-                FROM cat_activities
-                WHERE cat_name=%s AND YEAR(start_time) BETWEEN %s AND %s
-                GROUP BY YEAR(start_time)
-                ORDER BY YEAR(start_time)
-            """
-            cursor.execute(sql, (cat, s_y, e_y))
-            rows = cursor.fetchall() or []
-            for r in rows:
-                labels.append(f"{int(r['y']):04d}")
-                sl = float(r.get("sleep_min") or 0)
-                ea = int(r.get("eat_count") or 0)
-                ex = int(r.get("excrete_count") or 0)
-                sleep_min.append(sl); eat_cnt.append(ea); excrete_cnt.append(ex)
-                total_sleep += Decimal(sl); total_eat_cnt += ea; total_excrete += ex
-
-        return jsonify({
-            "labels": labels,
-            "series": {
-                
-                "sleepMinutes": sleep_min,
-                "eatCount":     eat_cnt,
-                "excreteCount": excrete_cnt,
-            },
-            "summary": {
-                "totalSleepHours": float(total_sleep) / 60.0,
-                "totalEatCount":   total_eat_cnt,
-                "totalExcreteCount": total_excrete,
-            }
-        })
-    finally:
-        cursor.close()
-        connection.close()
+            scope = _days(month_range(year, month))
+
+        cursor.execute(STATS_DAILY_SQL, (cat, *_days(month_range(year, month))))
+        rows = cursor.fetchall() or []
+        for r in rows:
+            labels.append(r["d"].strftime("%Y-%m-%d"))
+            sl = float(r.get("sleep_min") or 0)
+            ea = int(r.get("eat_count") or 0)
+            ex = int(r.get("excrete_count") or 0)
+            sleep_min.append(sl); eat_cnt.append(ea); excrete_cnt.append(ex)
+            total_sleep += Decimal(sl); total_eat_cnt += ea; total_excrete += ex
+
+    elif period == "monthly":
+        # รายเดือน: รวมต่อเดือนในปีที่เลือก (12 จุด)
+        if not year:
+            if maxy:
+                year = str(maxy)
+            else:
+                return {"labels": [], "series": {}, "summary": {}}, None
 
+        scope = _days(year_range(year))
+        cursor.execute(STATS_MONTHLY_SQL, (cat, *scope))
+        rows = cursor.fetchall() or []
+        for r in rows:
+            labels.append(f"{int(year):04d}-{int(r['mo']):02d}")
+            sl = float(r.get("sleep_min") or 0)
+            ea = int(r.get("eat_count") or 0)
+            ex = int(r.get("excrete_count") or 0)
+            sleep_min.append(sl); eat_cnt.append(ea); excrete_cnt.append(ex)
+            total_sleep += Decimal(sl); total_eat_cnt += ea; total_excrete += ex
+
+    else:
+        # รายปี: start_year → end_year (inclusive)
+        if not end_year and maxy: end_year = str(maxy)
+        if not start_year and miny: start_year = str(miny)
+        if not start_year or not end_year:
+            return {"labels": [], "series": {}, "summary": {}}, None
+
+        s_y = int(start_year); e_y = int(end_year)
+        if miny is not None: s_y = max(s_y, miny)
+        if maxy is not None: e_y = min(e_y, maxy)
+        if s_y > e_y: s_y, e_y = e_y, s_y
+
+        scope = _days(year_range(s_y, e_y))
+        cursor.execute(STATS_YEARLY_SQL, (cat, *scope))
+        rows = cursor.fetchall() or []
+        for r in rows:
+            labels.append(f"{int(r['y']):04d}")
+            sl = float(r.get("sleep_min") or 0)
+            ea = int(r.get("eat_count") or 0)
+            ex = int(r.get("excrete_count") or 0)
+            sleep_min.append(sl); eat_cnt.append(ea); excrete_cnt.append(ex)
+            total_sleep += Decimal(sl); total_eat_cnt += ea; total_excrete += ex
+
+    return {
+        "labels": labels,
+        "series": {
+
+            "sleepMinutes": sleep_min,
+            "eatCount":     eat_cnt,
+            "excreteCount": excrete_cnt,
+        },
+        "summary": {
+            "totalSleepHours": float(total_sleep) / 60.0,
+            "totalEatCount":   total_eat_cnt,
+            "totalExcreteCount": total_excrete,
+        }
+    }, scope
+
+
+# =========================================
+# G2) EXTERNAL WRITES — CHANGE WATCHER
+# =========================================
+# cat_activities / cat_movements ปกติถูกเขียนโดยโปรแกรมภายนอก (ไม่ผ่าน record_activity ฯลฯ)
+# thread เดียวตรวจ marker ราคาถูก (MAX บน PK/index) ทุก CHANGE_WATCH_SEC
+# marker เปลี่ยน → ทำงานแทน on_commit ที่ writer ภายนอกไม่ได้เรียก (rollup, ล้าง cache, SSE cat_room, long-poll)
+CHANGE_WATCH_SEC = 5.0
+ROLLUP_RECHECK_SEC = 600.0   # คำนวณ rollup ของ ROLLUP_RECHECK_DAYS วันล่าสุดใหม่ทุกเท่านี้
+ROLLUP_RECHECK_DAYS = 2      # (จับ UPDATE/DELETE ที่ MAX(id) มองไม่เห็น + ตอนเริ่ม process)
+
+ACTIVITIES_MARKER_SQL = "SELECT COALESCE(MAX(id), 0) AS max_id FROM cat_activities"
+ACTIVITIES_NEW_DAYS_SQL = """
+    SELECT DISTINCT DATE(start_time) AS day
+    FROM cat_activities
+    WHERE id > %s AND id <= %s
+"""
+ROLLUP_RANGE_SQL = """
+    SELECT cat_name, day, sleep_minutes, eat_count, excrete_count
+    FROM cat_activity_daily
+    WHERE day >= %s AND day < %s
+"""
+
+def refresh_rollup(ranges):
+    """
+    คำนวณ cat_activity_daily ใหม่จากข้อมูลดิบเฉพาะช่วงวัน [(date_from, date_to), ...] ใน transaction เดียว
+    แล้วล้าง stats_cache เฉพาะ (แมว, วัน) ที่ค่าเปลี่ยนจริง → คืนจำนวน (แมว, วัน) ที่เปลี่ยน
+    """
+    changed = set()
+    with db_cursor() as (connection, cursor):
+        try:
+            for lo, hi in ranges:
+                bounds = (lo, hi)
+                cursor.execute(ROLLUP_RANGE_SQL, bounds)
+                before = {(r["cat_name"], r["day"]): r for r in cursor.fetchall()}
+                cursor.execute("DELETE FROM cat_activity_daily WHERE day >= %s AND day < %s", bounds)
+                cursor.execute(rollup_backfill_sql(since=True, until=True),
+                               (day_range(lo)[0], day_range(hi)[0]))
+                cursor.execute(ROLLUP_RANGE_SQL, bounds)
+                after = {(r["cat_name"], r["day"]): r for r in cursor.fetchall()}
+                changed |= {k for k in before.keys() | after.keys() if before.get(k) != after.get(k)}
+            connection.commit()
+        except mysql.connector.Error:
+            connection.rollback()
+            raise
+    today = datetime.now().date()
+    for cat, day in changed:
+        year_index.add(day.year)
+        stats_cache.invalidate(cat, day)
+    if any(day == today for _, day in changed):
+        alert_evaluator.notify("activity")
+    return len(changed)
+
+
+class ChangeWatcher:
+    def __init__(self, interval=CHANGE_WATCH_SEC):
+        self.interval = interval
+        self._thread = None
+        self._lock = Lock()
+        self._watches = []          # (ชื่อ, sql marker, on_change(old, new))
+        self._marks = {}            # ชื่อ -> marker ล่าสุด (tuple)
+        self._last_recheck = None   # monotonic ของการ recheck rollup ล่าสุด (None = ยังไม่เคย)
+        self._stats = {"polls": 0, "changes": {}, "errors": 0, "last_error": None,
+                       "rollup_rechecks": 0, "rollup_changed": 0}
+
+    def watch(self, name, sql, on_change):
+        self._watches.append((name, sql, on_change))
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="change-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        try:
+            with db_cursor() as (connection, cursor):
+                marks = {}
+                for name, sql, _ in self._watches:
+                    cursor.execute(sql)
+                    marks[name] = tuple(cursor.fetchone().values())
+            for name, _, on_change in self._watches:
+                old = self._marks.get(name)
+                if old is not None and old != marks[name]:
+                    on_change(old, marks[name])
+                    with self._lock:
+                        self._stats["changes"][name] = self._stats["changes"].get(name, 0) + 1
+                self._marks[name] = marks[name]    # on_change ล้ม → ไม่เลื่อน marker รอบหน้าลองใหม่
+            if self._last_recheck is None or time.monotonic() - self._last_recheck >= ROLLUP_RECHECK_SEC:
+                self._recheck_rollup()
+        except (mysql.connector.Error, PoolTimeout) as e:
+            with self._lock:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(e)
+            print("⚠️ ตรวจการเปลี่ยนแปลงใน DB ไม่สำเร็จ:", e)
+        with self._lock:
+            self._stats["polls"] += 1
+
+    def _recheck_rollup(self):
+        today = datetime.now().date()
+        n = refresh_rollup([(today - timedelta(days=ROLLUP_RECHECK_DAYS), today + timedelta(days=1))])
+        self._last_recheck = time.monotonic()
+        with self._lock:
+            self._stats["rollup_rechecks"] += 1
+            self._stats["rollup_changed"] += n
+
+    def stats(self):
+        with self._lock:
+            st = dict(self._stats, changes=dict(self._stats["changes"]))
+        st.update(running=self._thread is not None and self._thread.is_alive(),
+                  interval_sec=self.interval, marks={k: list(v) for k, v in self._marks.items()})
+        return st
+
+
+change_watcher = ChangeWatcher()
+
+def _on_activities_changed(old, new):
+    """MAX(id) ของ cat_activities เปลี่ยน → คำนวณ rollup ใหม่เฉพาะวันของแถวใหม่ (อ่านตาม PK)"""
+    if new[0] < old[0]:
+        return    # แถวล่าสุดถูกลบ — recheck รอบถัดไปจัดการ
+    with db_cursor() as (connection, cursor):
+        cursor.execute(ACTIVITIES_NEW_DAYS_SQL, (old[0], new[0]))
+        days = sorted(r["day"] for r in cursor.fetchall() if r["day"] is not None)
+    refresh_rollup([(d, d + timedelta(days=1)) for d in days])
+
+change_watcher.watch("activities", ACTIVITIES_MARKER_SQL, _on_activities_changed)
+
+# แมวย้ายห้อง (writer ภายนอก): แถวใหม่ = MAX(id) ขยับ, เข้า/ออกห้อง = hash ของแถวที่เปิดอยู่เปลี่ยน
+MOVEMENTS_MARKER_SQL = f"""
+    SELECT m.max_id, o.open_n, o.open_h
+    FROM (SELECT COALESCE(MAX(id), 0) AS max_id FROM cat_movements) m,
+         ({OPEN_MOVEMENTS_MARKER_SQL}) o
+"""
+SSE_ROOM_EVENTS_MAX = 50   # แมวเปลี่ยนห้องพร้อมกันเกินนี้ → ส่ง reset ให้ client โหลดใหม่ทีเดียว
+_open_rooms = None         # แมว -> ห้อง ตอน marker เปลี่ยนครั้งก่อน (None = ยังไม่รู้ → reset)
+
+def _on_movements_changed(old, new):
+    """เทียบห้องปัจจุบันใน DB กับรอบก่อน → cat_room เฉพาะแมวที่ห้องเปลี่ยนจริง"""
+    global _open_rooms
+    resource_versions.bump("cats")
+    with db_cursor() as (connection, cursor):
+        cursor.execute(OPEN_MOVEMENTS_SQL)
+        rooms = {r["cat_name"]: r["room_name"] for r in cursor.fetchall()}
+    prev, _open_rooms = _open_rooms, rooms
+    changed = [] if prev is None else sorted(
+        cat for cat in prev.keys() | rooms.keys() if prev.get(cat) != rooms.get(cat))
+    if prev is None or len(changed) > SSE_ROOM_EVENTS_MAX or new[0] < old[0]:
+        event_bus.publish("reset", {})
+        return
+    now = datetime.now()
+    for cat in changed:
+        event_bus.publish("cat_room", {"cat": cat, "room": rooms.get(cat), "at": now})
+
+change_watcher.watch("movements", MOVEMENTS_MARKER_SQL, _on_movements_changed)
+
+# alerts_log ที่ process อื่นเขียน (worker อีกตัว / แก้ DB ตรง ๆ) → ปลุก long-poll ของ process นี้
+change_watcher.watch("alerts", RESOURCE_ETAG_SQL["alerts"], lambda old, new: resource_versions.bump("alerts"))
+
+@app.route("/api/changes/stats", methods=["GET"])
+def api_change_watcher_stats():
+    return jsonify(change_watcher.stats())
+
+
+# =========================================
+# H) BENCHMARKS / CLI
+# =========================================
+def bench_mjpeg_fanout(viewer_counts=(1, 10, 50), fps=30):
+    """
+    เทียบต้นทุนต่อวินาทีระหว่าง
+      - per-viewer: แบบเดิม (ทุกผู้ชม imencode + tobytes + ต่อ bytes เอง)
+      - shared    : FrameSlot (เข้ารหัส/ห่อ chunk ครั้งเดียว ผู้ชมทุกคนใช้ object เดียวกัน)
+    ใช้เฟรมสังเคราะห์ 1280x720 ไม่ต้องต่อกล้องจริง จำลองสตรีม 1 วินาที (fps เฟรม)
+    """
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8)
+    src = [np.roll(base, i * 8, axis=1) for i in range(8)]
+
+    def per_viewer(viewers):
+        encodes = copied = 0
+        for i in range(fps):
+            for _ in range(viewers):
+                ret, buf = cv2.imencode(".jpg", src[i % len(src)])
+                payload = buf.tobytes()
+                chunk = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + payload + b"\r\n"
+                encodes += 1
+                copied += len(payload) + len(chunk)
+        return encodes, copied
+
+    def shared(viewers):
+        encodes = copied = 0
+        for i in range(fps):
+            chunk = encode_mjpeg_chunk(src[i % len(src)])
+            slot = FrameSlot(i + 1, chunk, time.time())
+            encodes += 1
+            copied += len(chunk)
+            for _ in range(viewers):
+                _ = slot.chunk   # ผู้ชมแต่ละคน yield object เดิม ไม่มี copy
+        return encodes, copied
+
+    # cpu s/s = เวลาที่ใช้จริงต่อสตรีม 1 วินาที (>1 แปลว่าเครื่องตามไม่ทัน)
+    print(f"{'mode':<12}{'viewers':>8}{'encode/s':>10}{'MB copied/s':>13}{'cpu s/s':>9}")
+    for viewers in viewer_counts:
+        for name, fn in (("per-viewer", per_viewer), ("shared", shared)):
+            t0 = time.perf_counter()
+            encodes, copied = fn(viewers)
+            wall = time.perf_counter() - t0
+            print(f"{name:<12}{viewers:>8}{encodes:>10}{copied / 1e6:>13.1f}{wall:>9.2f}")
+
+
+def bench_alert_queries(cat_counts=(5, 50, 500), repeat=20):
+    """
+    นับจำนวน query ต่อการเรียก _compute_alerts_today หนึ่งครั้ง ที่จำนวนแมวต่าง ๆ
+    ใช้ cursor จำลอง (ไม่ต้องมี MySQL) — คอลัมน์ new วัดจริง
+    คอลัมน์ "legacy (N+8)" ไม่ได้วัด: คิดจากสูตรของโค้ดเดิม (config 1 + last_seen 1 + TIMESTAMPDIFF ต่อแมว N
+    + aggregate 3 + SELECT name FROM cats 3) ไว้เทียบเท่านั้น
+    """
+    cfg_row = {"id": ACTIVE_CONFIG_ID, "alert_no_cat": 6, "alert_no_eat": 3,
+               "alert_no_excrete_min": 1, "alert_no_excrete_max": 4,
+               "alert_no_sleep_min": 10, "alert_no_sleep_max": 16, "max_supported_cats": 1000}
+
+    class CountingCursor:
+        def __init__(self, snapshot):
+            self.snapshot = snapshot
+            self.queries = 0
+            self._rows = []
+
+        def execute(self, sql, params=()):
+            self.queries += 1
+            self._rows = [cfg_row] if "system_config" in sql else self.snapshot
+
+        def fetchone(self):
+            return self._rows[0] if self._rows else None
+
+        def fetchall(self):
+            return list(self._rows)
+
+    print(f"{'cats':>6}{'legacy (N+8)':>14}{'new q/call':>12}{'new q/call (cfg cold)':>23}{'ms/call':>9}")
+    for n in cat_counts:
+        snapshot = [
+            {"cat_name": f"cat{i:04d}", "last_seen": datetime.now(), "hours_since_seen": i % 12,
+             "eats": i % 5, "excretes": i % 6, "sleep_minutes": (i * 37) % 1200}
+            for i in range(n)
+        ]
+        config_cache.invalidate(ACTIVE_CONFIG_ID)
+        cold = CountingCursor(snapshot)
+        _compute_alerts_today(cold)
+        warm = CountingCursor(snapshot)
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            _compute_alerts_today(warm)
+        ms = (time.perf_counter() - t0) * 1000.0 / repeat
+        print(f"{n:>6}{n + 8:>14}{warm.queries / repeat:>12.0f}{cold.queries:>23}{ms:>9.2f}")
+    config_cache.invalidate(ACTIVE_CONFIG_ID)
+
+
+def _hot_queries():
+    """(ชื่อ, sql, params ตัวอย่าง) ของ query ที่ถูกเรียกบ่อย — ใช้ใน explain-check"""
+    today = datetime.now().date()
+    day = day_range(today)
+    by_cat_range, by_cat_range_params = activities_query("__explain__", day[0], day[1], (day[0], 0))
+    by_range, by_range_params = activities_query(None, day[0], day[1])
+    return [
+        ("alerts.snapshot", ALERT_SNAPSHOT_SQL, ()),
+        ("activities.by_cat_range", by_cat_range + " LIMIT %s", (*by_cat_range_params, ACTIVITIES_MAX_PAGE + 1)),
+        ("activities.by_range", by_range + " LIMIT %s", (*by_range_params, ACTIVITIES_MAX_PAGE + 1)),
+        ("statistics.daily", STATS_DAILY_SQL, ("__explain__", *_days(month_range(today.year, today.month)))),
+        ("statistics.monthly", STATS_MONTHLY_SQL, ("__explain__", *_days(year_range(today.year)))),
+        ("statistics.yearly", STATS_YEARLY_SQL, ("__explain__", *_days(year_range(today.year - 5, today.year)))),
+        ("statistics.last_in_year", STATS_LAST_IN_RANGE_SQL, ("__explain__", *_days(year_range(today.year)))),
+        ("alerts.delta_new", alerts_delta_sql(True, False), (0, ALERTS_DELTA_LIMIT + 1)),
+        ("alerts.delta_new_unread_cat", alerts_delta_sql(False, True), (0, "__explain__", ALERTS_DELTA_LIMIT + 1)),
+        ("alerts.delta_tombstones", alerts_tombstones_sql(False), (day[0], 0)),
+        ("year_index.next_year", YEAR_INDEX_NEXT_SQL, (year_range(today.year)[0],)),
+        ("etag.cats", RESOURCE_ETAG_SQL["cats"], ()),
+        ("etag.alerts", RESOURCE_ETAG_SQL["alerts"], ()),
+        ("changes.activities_new_days", ACTIVITIES_NEW_DAYS_SQL, (0, 1000)),
+        ("changes.movements_marker", MOVEMENTS_MARKER_SQL, ()),
+        ("changes.open_movements", OPEN_MOVEMENTS_SQL, ()),
+    ]
+
+# ตารางที่โตตามเวลา — ห้าม full scan (cats/rooms เล็ก อ่านทั้งตารางได้)
+EXPLAIN_GUARDED_TABLES = {"cat_activities", "cat_movements", "alerts_log", "cat_activity_daily"}
+
+def explain_check(strict=False):
+    """
+    รัน EXPLAIN กับ _hot_queries() บน DB จริง แล้วคืน exit code
+    ล้ม (1) เมื่อ query แตะตารางใหญ่แบบ type=ALL โดยไม่มี index ให้เลือกเลย (possible_keys ว่าง)
+    = predicate ใช้ index ไม่ได้; ถ้ามี index แต่ optimizer เลือก scan เอง (ตารางยังเล็ก) แค่เตือน
+    strict=True (--strict, ใช้ใน CI ที่มีข้อมูลจริง) → type=ALL บนตารางใหญ่ล้มทุกกรณี
+    """
+    failed = 0
+    with db_cursor() as (connection, cursor):
+        for name, sql, params in _hot_queries():
+            cursor.execute("EXPLAIN " + sql, params)
+            bad = 0
+            for row in cursor.fetchall():
+                table = row.get("table") or ""
+                if table not in EXPLAIN_GUARDED_TABLES or row.get("type") != "ALL":
+                    continue
+                if row.get("possible_keys") and not strict:
+                    print(f"⚠️ {name}: {table} scan ทั้งตาราง (มี index {row['possible_keys']} แต่ optimizer ไม่เลือก)")
+                elif row.get("possible_keys"):
+                    print(f"❌ {name}: {table} full scan (มี index {row['possible_keys']} แต่ optimizer ไม่เลือก)")
+                    bad += 1
+                else:
+                    print(f"❌ {name}: {table} full scan — ไม่มี index ที่ใช้ได้")
+                    bad += 1
+            if not bad:
+                print(f"✅ {name}")
+            failed += bad
+    return 1 if failed else 0
 
 
 # =========================================
 # MAIN
 # =========================================
+# python App.py               → รันเว็บเซิร์ฟเวอร์
+# python App.py migrate       → อัปเดต schema ของ DB
+# python App.py bench-mjpeg   → micro-benchmark การแจกเฟรม MJPEG
+# python App.py bench-alerts  → จำนวน query ต่อการคำนวณ alert ที่ 5/50/500 ตัว
+# python App.py explain-check [--strict] → ตรวจ EXPLAIN ของ query หลัก (exit 1 ถ้ามี full scan)
+# python App.py backfill-rollup [YYYY-MM-DD] → สร้าง cat_activity_daily ใหม่ (ทั้งหมด / ตั้งแต่วันที่)
+def start_background_services():
+    """งานเบื้องหลังของ process ที่เสิร์ฟจริง (ใช้ทั้ง app.run ด้านล่าง และ lifespan ของ asgi.py)"""
+    if DETECT_CFG["enabled"]:
+        cat_detector.start()
+    alert_evaluator.start()
+    change_watcher.start()
+
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if cmd == "bench-mjpeg":
+        bench_mjpeg_fanout()
+    elif cmd == "bench-alerts":
+        bench_alert_queries()
+    elif cmd == "explain-check":
+        sys.exit(explain_check(strict="--strict" in sys.argv[2:]))
+    elif cmd == "backfill-rollup":
+        since = _parse_date(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"✅ cat_activity_daily: {backfill_rollup(since)} แถว")
+    elif cmd == "migrate":
+        run_migrations(allow_destructive=True)
+    else:
+        try:
+            run_migrations()
+        except mysql.connector.Error as e:
+            print("⚠️ รัน migration ไม่ได้ (ตรวจสอบ MySQL):", e)
+        # debug reloader รันไฟล์นี้ 2 process → เปิดงานเบื้องหลังเฉพาะ process ที่เสิร์ฟจริง
+        # (ผู้ชมสตรีม/SSE จำนวนมาก → ใช้ asgi.py แทน: ไม่ถือ thread ต่อ connection)
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_background_services()
+        app.run(debug=True, port=5000)
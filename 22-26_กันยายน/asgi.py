@@ -0,0 +1,171 @@
+"""
+โหมดเสิร์ฟแบบ async (ASGI) — ใช้แทน `python App.py` เมื่อมีผู้ชมสตรีม/SSE/long-poll จำนวนมาก
+
+    pip install uvicorn a2wsgi
+    uvicorn asgi:app --port 5000        (หรือ python asgi.py)
+
+connection ที่ค้างนาน (/video_feed, /api/events, /api/alerts?wait=N) เป็น coroutine บน event loop เดียว
+→ ผู้ชมไม่ถือ worker thread คนละตัว, process เดียวรับได้หลายร้อย connection
+route อื่นทั้งหมดส่งต่อให้ Flask app เดิมใน App.py (ผ่าน a2wsgi) — logic/validation ชุดเดียวกัน
+"""
+import asyncio
+import os
+from urllib.parse import parse_qsl
+
+import mysql.connector
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags
+
+import App as core
+
+wsgi_app = WSGIMiddleware(core.app)
+
+MJPEG_HEADERS = [(b"content-type", b"multipart/x-mixed-replace; boundary=frame")]
+SSE_HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+CORS_HEADER = (b"access-control-allow-origin", b"*")   # แบบเดียวกับ CORS(app) ใน App.py
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "GET":
+        parts = scope["path"].split("/")
+        args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1")))
+        if len(parts) == 4 and parts[1] == "video_feed":
+            return await video_feed(scope, receive, send, parts[2], parts[3], args)
+        if scope["path"] == "/api/events":
+            return await api_events(scope, receive, send, args)
+        if scope["path"] == "/api/alerts" and args.get("wait"):
+            return await list_alerts(scope, receive, send, args)
+    return await wsgi_app(scope, receive, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.to_thread(core.run_migrations)
+            except mysql.connector.Error as e:
+                print("⚠️ รัน migration ไม่ได้ (ตรวจสอบ MySQL):", e)
+            core.start_background_services()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# =========================================
+# ROUTES (coroutine) — ตรงกับ route ชื่อเดียวกันใน App.py
+# =========================================
+async def video_feed(scope, receive, send, room_name, which, args):
+    if which == "mosaic":
+        source = core.camera_hub.mosaic(room_name)
+    elif which.isascii() and which.isdigit():    # isdigit() อย่างเดียวรับ "²" ด้วย แล้ว int() ล้ม
+        source = core.camera_hub.get(room_name, int(which))
+    else:
+        return await wsgi_app(scope, receive, send)
+    if not source:
+        return await _send_text(send, 404, "room not found" if which == "mosaic" else "camera not found")
+    tier = core.parse_stream_tier(args)
+    if tier is None:
+        return await _send_text(send, 400, "invalid stream profile")
+    await _stream(receive, send, source.aframes(tier), MJPEG_HEADERS)
+
+
+async def api_events(scope, receive, send, args):
+    last_id = _header(scope, b"last-event-id") or args.get("last_id") or None
+    await _stream(receive, send, core.event_bus.asubscribe(last_id), SSE_HEADERS)
+
+
+async def list_alerts(scope, receive, send, args):
+    """เฉพาะ long-poll (wait > 0) — รอด้วย coroutine, query จริงยังรันใน thread (mysql.connector เป็น sync)"""
+    try:
+        cat, include_read, wait, since_id, since = core.parse_alerts_args(args)
+    except ValueError:
+        return await wsgi_app(scope, receive, send)     # Flask ตอบ 400 ข้อความเดียวกัน
+    core.alert_evaluator.start()
+    versions = core.resource_versions
+    version = versions.version("alerts")    # ก่อน query/ETag เสมอ (ดู list_alerts ใน App.py)
+    if since_id is not None:
+        delta = await asyncio.to_thread(core._alerts_delta, cat, include_read, since_id, since)
+        if wait and since_id > 0 and not delta["items"] and not delta["tombstones"]:
+            if await versions.await_change("alerts", version, wait):
+                delta = await asyncio.to_thread(core._alerts_delta, cat, include_read, since_id, since)
+        return await _send_json(send, delta)
+    # ส่งต่อ Flask โดยตัด wait ออก: ถ้า ETag ไม่เปลี่ยน (เช่น mark-read แถวที่อ่านแล้ว)
+    # Flask จะได้ตอบ 304 ทันที ไม่ค้างรอซ้ำอีกรอบใน worker thread ของ a2wsgi
+    flask_scope = _without_arg(scope, b"wait")
+    etag = await asyncio.to_thread(core.resource_etag, "alerts")
+    if not parse_etags(_header(scope, b"if-none-match")).contains_weak(etag):
+        return await wsgi_app(flask_scope, receive, send)
+    if await versions.await_change("alerts", version, wait):
+        return await wsgi_app(flask_scope, receive, send)   # alerts เปลี่ยน → Flask ตอบรายการใหม่
+    await send({"type": "http.response.start", "status": 304,
+                "headers": [(b"etag", f'"{etag}"'.encode()), CORS_HEADER]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+# =========================================
+# HELPERS
+# =========================================
+def _header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _without_arg(scope, name):
+    """scope เดิมแต่ตัด query arg ชื่อ name ออก (ส่วนอื่นของ query string คงไว้ตามเดิม)"""
+    parts = [p for p in scope["query_string"].split(b"&") if p.split(b"=", 1)[0] != name]
+    return dict(scope, query_string=b"&".join(parts))
+
+
+async def _send_text(send, status, text):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"), CORS_HEADER]})
+    await send({"type": "http.response.body", "body": text.encode()})
+
+
+async def _send_json(send, payload):
+    body = core.app.json.dumps(payload).encode()    # serializer เดียวกับ jsonify (datetime ฯลฯ)
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json"), CORS_HEADER]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _stream(receive, send, chunks, headers):
+    """
+    ส่ง async generator ออกไปเรื่อยๆ จนกว่าจะหมดหรือ client ปิด
+    client ปิด → ยกเลิกทันที (ไม่ต้องรอเฟรม/event ถัดไป) แล้ว aclose() ให้ finally ของ generator คืน subscriber
+    """
+    await send({"type": "http.response.start", "status": 200, "headers": headers + [CORS_HEADER]})
+
+    async def pump():
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", 5000)))
@@ -17,8 +17,11 @@ const ENDPOINTS = {
   alertsDelete: `${API_BASE}/api/alerts/delete`,
   systemConfig: `${API_BASE}/api/system_config`,
   rooms: `${API_BASE}/api/rooms`,
+  events: `${API_BASE}/api/events`,
 };
-const REFRESH_INTERVAL = 5000;
+const REFRESH_INTERVAL = 5000;             // poll ถี่ตอน SSE ใช้ไม่ได้/หลุด
+const SSE_REFRESH_INTERVAL = 60000;        // ต่อ SSE ได้แล้วยัง poll ช้า ๆ กันพลาด (เช่นเพิ่มแมว) — ปกติได้ 304
+const SNAPSHOT_REFRESH_INTERVAL = 10000;   // รีเฟรชภาพนิ่งในการ์ดห้อง (หน้า Home)
 
 /* =========================
  * 2) STATE
@@ -26,11 +29,15 @@ const REFRESH_INTERVAL = 5000;
 let cats = [];
 let selectedCatId = null;        // ชื่อแมวที่เลือก (จำมาจากหน้า Cat/Detail)
 let refreshTimer = null;
+let refreshEvery = 0;
+let eventSource = null;
+let eventsReconnecting = false;
 
 let rooms = [];                  // [{name, cameras:[{label,index}]}]
 let currentRoomIndex = null;
 let currentCameraIndex = 0;
 let cameraTimestampTimer = null;
+let snapshotTimer = null;
 
 // navigation: จำหน้าเดิมก่อนเปิด Alerts
 let lastPageId = null;
@@ -58,12 +65,90 @@ function focusAlertIfNeeded() {
  * ========================= */
 document.addEventListener("DOMContentLoaded", () => {
   fetchCatDataFromAPI();
-  refreshTimer = setInterval(updateCatData, REFRESH_INTERVAL);
+  connectEvents();
   loadSystemConfig();
 
   loadRoomsAndRender();
 });
 
+/* =========================
+ * 3.1) SERVER-SENT EVENTS (แทนการ poll /api/cats ทุก 5 วินาที)
+ * ========================= */
+function startPolling(interval = REFRESH_INTERVAL) {
+  if (refreshTimer && refreshEvery === interval) return;
+  stopPolling();
+  refreshEvery = interval;
+  refreshTimer = setInterval(updateCatData, interval);
+}
+
+function stopPolling() {
+  if (refreshTimer) clearInterval(refreshTimer);
+  refreshTimer = null;
+}
+
+// ไม่มี EventSource: หน้า Notifications ใช้ long-poll แทนการยิงซ้ำถี่ ๆ
+const LONG_POLL_WAIT_SEC = 30;
+const LONG_POLL_MIN_GAP = 1000;   // ms — ตอบกลับทันทีติดกัน (ไม่ได้ค้างรอ) ก็ไม่ยิงถี่กว่านี้
+let longPolling = false;
+
+function longPollNotifications() {
+  if (longPolling) return;
+  longPolling = true;
+  const loop = () => {
+    if (getVisiblePageId() !== "notificationsPage" || !notifSync) { longPolling = false; return; }
+    const started = Date.now();
+    syncNotifications(LONG_POLL_WAIT_SEC).then(
+      () => setTimeout(loop, Math.max(0, LONG_POLL_MIN_GAP - (Date.now() - started))),
+      // non-2xx (syncNotifications reject) / network error → รอ REFRESH_INTERVAL ก่อนลองใหม่
+      () => setTimeout(loop, REFRESH_INTERVAL)
+    );
+  };
+  loop();
+}
+
+function connectEvents() {
+  if (!window.EventSource) { startPolling(); return; }
+  eventSource = new EventSource(ENDPOINTS.events);
+
+  eventSource.addEventListener("open", () => {
+    startPolling(SSE_REFRESH_INTERVAL);
+    // ต่อใหม่หลังหลุด → ดึงรายการล่าสุดครั้งเดียว เผื่อพลาด event ระหว่างนั้น
+    if (eventsReconnecting) updateCatData();
+    eventsReconnecting = false;
+  });
+  eventSource.addEventListener("error", () => {
+    // EventSource จะต่อใหม่เอง ระหว่างรอ poll แบบเดิมไปก่อน
+    eventsReconnecting = true;
+    startPolling();
+  });
+
+  eventSource.addEventListener("cat_room", (e) => {
+    const ev = JSON.parse(e.data);
+    const cat = cats.find((c) => c.name === ev.cat);
+    if (!cat) { updateCatData(); return; }
+    if (ev.room !== null) cat.current_room = ev.room;
+    else if (ev.left === undefined || cat.current_room === ev.left) cat.current_room = null;
+    updateOpenCatDetail();
+  });
+
+  eventSource.addEventListener("alerts", (e) => {
+    const items = JSON.parse(e.data).items || [];
+    const page = getVisiblePageId();
+    if (page === "notificationsPage") (notifSync ? syncNotifications() : loadNotifications()).catch(() => {});
+    if (page === "alertsPage" && items.some((a) => a.cat === selectedCatId)) loadAlerts();
+  });
+
+  eventSource.addEventListener("config", (e) => {
+    const ev = JSON.parse(e.data);
+    if (ev.config) applySystemConfig(ev.config);
+  });
+
+  eventSource.addEventListener("reset", () => {
+    updateCatData();
+    loadSystemConfig();
+  });
+}
+
 /* =========================
  * Utils
  * ========================= */
@@ -200,6 +285,8 @@ function loadRoomsAndRender() {
     .then(data => {
       rooms = Array.isArray(data) ? data : [];
       renderRoomCards(rooms);
+      if (snapshotTimer) clearInterval(snapshotTimer);
+      snapshotTimer = setInterval(refreshRoomSnapshots, SNAPSHOT_REFRESH_INTERVAL);
     })
     .catch(err => console.error("❌ โหลดผังห้อง/กล้องล้มเหลว:", err));
 }
@@ -212,10 +299,17 @@ function renderRoomCards(roomList) {
     const card = document.createElement("div");
     card.className = "room-card";
     card.onclick = () => selectRoom(idx);
+    // ภาพนิ่งจาก /api/snapshot (ไม่เปิดสตรีม MJPEG ต่อกล้อง)
+    const hasCam = (room.cameras || []).length > 0;
+    const preview = hasCam
+      ? `<img class="room-snapshot" data-room="${room.name}" src="${snapshotUrl(room.name, 0)}"
+              style="width:100%; height:100%; object-fit:cover;" alt="${room.name}"
+              onerror="this.replaceWith(Object.assign(document.createElement('div'), {className: 'camera-placeholder', textContent: '📹'}))">`
+      : `<div class="camera-placeholder">📹</div>`;
     card.innerHTML = `
       <div class="room-preview">
         <div class="live-preview">
-          <div class="camera-placeholder">📹</div>
+          ${preview}
         </div>
       </div>
       <h3>${capitalize(room.name || "Room")}</h3>
@@ -225,6 +319,25 @@ function renderRoomCards(roomList) {
   });
 }
 
+function snapshotUrl(roomName, camIndex) {
+  return `${API_BASE}/api/snapshot/${encodeURIComponent(roomName)}/${camIndex}?profile=low`;
+}
+
+// cache: "no-cache" = ถาม server ทุกครั้ง (ETag/Last-Modified) → ภาพไม่เปลี่ยนได้ 304 ไม่ดาวน์โหลด JPEG ซ้ำ
+function refreshRoomSnapshots() {
+  if (getVisiblePageId() !== "homePage") return;
+  document.querySelectorAll("img.room-snapshot").forEach(img => {
+    fetch(snapshotUrl(img.dataset.room, 0), { cache: "no-cache" })
+      .then(res => (res.ok ? res.blob() : null))
+      .then(blob => {
+        if (!blob) return;
+        if (img.src.startsWith("blob:")) URL.revokeObjectURL(img.src);
+        img.src = URL.createObjectURL(blob);
+      })
+      .catch(() => {});
+  });
+}
+
 function selectRoom(index) {
   if (index < 0 || index >= rooms.length) return;
   currentRoomIndex = index;
@@ -255,7 +368,9 @@ function updateCameraUI() {
     ? `กล้อง ${currentCameraIndex + 1} จาก ${cams.length}`
     : `ไม่มีกล้องในห้องนี้`;
 
-  const feed = cam ? `${API_BASE}/video_feed/${room.name}/${cam.index}` : "";
+  // เปิดสตรีมเสมอแม้กล้องเคย offline: server ต่อ RTSP ใหม่เฉพาะตอนมีผู้ชม และส่งเฟรมดีล่าสุดซ้ำระหว่างรอ
+  refreshCameraState(room.name, currentCameraIndex);
+  const feed = cam ? `${API_BASE}/video_feed/${encodeURIComponent(room.name)}/${cam.index}` : "";
   document.getElementById("cameraFeed").innerHTML = cam
     ? `<img src="${feed}" style="width:100%; height:100%; object-fit:cover;" alt="${cam.label}">`
     : `<div class="simulated-video"><div class="camera-placeholder large">📹</div><p>ไม่มีกล้อง</p></div>`;
@@ -268,6 +383,23 @@ function updateCameraUI() {
   document.getElementById("timestamp").textContent = new Date().toLocaleString();
 }
 
+// สถานะกล้องจาก /api/rooms ล่าสุด (rooms ที่โหลดตอนเปิดหน้าอาจเก่าแล้ว)
+function refreshCameraState(roomName, camIndex) {
+  fetch(ENDPOINTS.rooms)
+    .then(res => res.json())
+    .then(data => {
+      if (!Array.isArray(data)) return;
+      rooms = data;
+      const room = rooms[currentRoomIndex] || {};
+      const cam = (room.cameras || [])[camIndex];
+      if (room.name !== roomName || currentCameraIndex !== camIndex || !cam) return;
+      const info = `กล้อง ${camIndex + 1} จาก ${room.cameras.length}`;
+      document.getElementById("cameraInfo").textContent =
+        cam.state === "offline" ? `${info} (ออฟไลน์ กำลังเชื่อมต่อใหม่)` : info;
+    })
+    .catch(err => console.error("❌ โหลดสถานะกล้องล้มเหลว:", err));
+}
+
 function previousCamera() {
   if (currentRoomIndex === null) return;
   if (currentCameraIndex > 0) {
@@ -632,22 +764,24 @@ function goBackFromStatistics() {
 function loadSystemConfig() {
   fetch(ENDPOINTS.systemConfig)
     .then(res => res.json())
-    .then(cfg => {
-      const setVal = (id, v) => {
-        const el = document.getElementById(id);
-        if (el && v !== undefined && v !== null) el.value = v;
-      };
-      setVal("alertNoCat", cfg.alertNoCat);
-      setVal("alertNoEating", cfg.alertNoEating);
-      setVal("minExcretion", cfg.minExcretion);
-      setVal("maxExcretion", cfg.maxExcretion);
-      setVal("minSleep", cfg.minSleep);
-      setVal("maxSleep", cfg.maxSleep);
-      setVal("maxCats", cfg.maxCats);
-    })
+    .then(applySystemConfig)
     .catch(()=>{});
 }
 
+function applySystemConfig(cfg) {
+  const setVal = (id, v) => {
+    const el = document.getElementById(id);
+    if (el && v !== undefined && v !== null) el.value = v;
+  };
+  setVal("alertNoCat", cfg.alertNoCat);
+  setVal("alertNoEating", cfg.alertNoEating);
+  setVal("minExcretion", cfg.minExcretion);
+  setVal("maxExcretion", cfg.maxExcretion);
+  setVal("minSleep", cfg.minSleep);
+  setVal("maxSleep", cfg.maxSleep);
+  setVal("maxCats", cfg.maxCats);
+}
+
 function saveSystemConfig() {
   const payload = {
     alertNoCat: +document.getElementById("alertNoCat")?.value || null,
@@ -996,23 +1130,48 @@ function signOut() {
  * Notifications — แสดงแจ้งเตือน "ยังไม่อ่าน" ของทุกแมว
  * ========================= */
 
+// เก็บรายการที่แสดงอยู่ + high-water mark → ครั้งต่อไปดึงเฉพาะส่วนที่เปลี่ยน (since_id/since)
+let notifRows = new Map();       // id -> alert (ยังไม่อ่าน)
+let notifSync = null;            // { since_id, since } จากเซิร์ฟเวอร์
+
 function loadNotifications() {
   const container = document.querySelector("#notificationsPage .notifications-list");
-  if (!container) return;
+  if (!container) return Promise.resolve();
   container.innerHTML = `<div class="notification-item">กำลังโหลด...</div>`;
 
-  // ดึงเฉพาะยังไม่อ่านทั้งหมด (ทุกแมว)
-  const qs = new URLSearchParams();
-  qs.set("include_read", "0");
-
-  fetch(`${ENDPOINTS.alerts}?${qs.toString()}`)
-    .then(r => r.json())
-    .then(rows => renderNotifications(Array.isArray(rows) ? rows : []))
+  // เริ่มใหม่: since_id=0 = รายการยังไม่อ่านล่าสุดทั้งหมด (ทุกแมว)
+  notifRows = new Map();
+  notifSync = null;
+  return syncNotifications()
+    .then(() => { if (!window.EventSource) longPollNotifications(); })
     .catch(() => {
       container.innerHTML = `<div class="notification-item">โหลดข้อมูลไม่ได้</div>`;
     });
 }
 
+function syncNotifications(wait = 0) {
+  const qs = new URLSearchParams();
+  qs.set("include_read", "0");
+  qs.set("since_id", notifSync ? notifSync.since_id : 0);
+  if (notifSync) qs.set("since", notifSync.since);
+  if (wait) qs.set("wait", wait);   // long-poll: เซิร์ฟเวอร์ค้างไว้จนมีของใหม่หรือครบเวลา
+
+  return fetch(`${ENDPOINTS.alerts}?${qs.toString()}`)
+    .then(r => {
+      // 503 (pool เต็ม) / 400 ฯลฯ → reject โดยไม่แตะ notifSync เดิม รอบหน้ายังใช้ since_id เดิมได้
+      if (!r.ok) throw new Error(`alerts sync failed: ${r.status}`);
+      return r.json();
+    })
+    .then(delta => {
+      (delta.items || []).forEach(a => notifRows.set(a.id, a));
+      (delta.tombstones || []).forEach(t => notifRows.delete(t.id));   // อ่านแล้ว/ซ่อน → เอาออก
+      notifSync = { since_id: delta.since_id, since: delta.since };
+      const rows = [...notifRows.values()].sort((a, b) => b.id - a.id);
+      renderNotifications(rows);
+      if (delta.more) return syncNotifications();
+    });
+}
+
 function renderNotifications(rows) {
   const container = document.querySelector("#notificationsPage .notifications-list");
   if (!container) return;